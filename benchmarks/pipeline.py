@@ -0,0 +1,502 @@
+"""Measures how long each stage of merging data takes and how much memory it uses.
+
+Synthetic data is generated for each size N: elemental data and profilometer
+data with N x N elements of 5 µm, and Brillouin data covering the same area with
+N/10 x N/10 elements of 50 µm. Each stage of loading, manipulating, drawing,
+aligning, and saving the data is timed, then run again to measure the peak
+memory allocated by Python and NumPy while it runs.
+
+Run from the repository root:
+
+    python benchmarks/pipeline.py --sizes 1000 10000 --output report.json
+
+A previous report can be compared against to catch regressions:
+
+    python benchmarks/pipeline.py --sizes 1000 10000 --compare report.json
+
+The exit status is 1 if any stage is slower than in the compared report by more
+than the tolerance.
+"""
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from typing import Any, Callable
+
+import numpy as np
+from pewlib import Config, Laser
+from pewlib.io.npz import load as load_npz, save as save_pewlib_npz
+from PySide6 import QtCore, QtGui, QtWidgets
+
+# Benchmarks are run as scripts, so the repository root isn't on the path.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datamerger.io import brillouin, cache, npz, profilometer
+from datamerger.io.sized_data import SizedData
+from datamerger.merge import Alignment, add_aligned_data, align_data
+from datamerger.widget.data_alignment_view import DataManipulator
+from datamerger.widget.tiled_image_item import TiledImageItem
+from datamerger.widget.turbo_color_table import turbo_color_table
+
+# The elements of the synthetic elemental data.
+_ELEMENTS = ["Na", "Fe", "Cu"]
+
+# The width and height in pixels of the viewport that images are drawn into.
+_VIEWPORT_SIZE = 1024
+
+# Differences in time smaller than this many seconds are treated as noise when
+# comparing reports.
+_MINIMUM_REGRESSION = 0.05
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--compare",
+        help="a previous report to compare the times against",
+        metavar="REPORT",
+    )
+    parser.add_argument(
+        "--data-dir",
+        help="the directory to keep generated data in, so it can be reused by"
+        " later runs (default: a temporary directory)",
+    )
+    parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="don't measure peak memory, which runs each stage again",
+    )
+    parser.add_argument("--output", help="the path to write the report to")
+    parser.add_argument(
+        "--sizes",
+        default=[500, 2000],
+        help="the widths and heights of the data (default: 500 2000)",
+        nargs="+",
+        type=int,
+    )
+    parser.add_argument(
+        "--tolerance",
+        default=0.25,
+        help="the fraction by which a stage may be slower than in the compared"
+        " report (default: 0.25)",
+        type=float,
+    )
+    args = parser.parse_args()
+
+    # scipy.ndimage is imported when it's first used, so import it up front to
+    # avoid counting the time taken to import it in the first stage using it.
+    import scipy.ndimage
+
+    # Images are drawn off screen, so no display is needed.
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    app = QtWidgets.QApplication()
+
+    temporary_path = tempfile.mkdtemp()
+    try:
+        data_path = args.data_dir or temporary_path
+        os.makedirs(data_path, exist_ok=True)
+
+        results = []
+        for size in args.sizes:
+            print(f"Size {size}:")
+            paths = _generate_data(data_path, size)
+            pipeline = _Pipeline(paths, os.path.join(temporary_path, str(size)))
+            for name, stage in pipeline.stages:
+                seconds, peak_memory = _measure(stage, not args.no_memory)
+                results.append(
+                    {
+                        "peak_memory": peak_memory,
+                        "seconds": seconds,
+                        "size": size,
+                        "stage": name,
+                    }
+                )
+
+                memory = (
+                    "" if peak_memory is None else f"{peak_memory / 2**20:8.1f} MiB"
+                )
+                print(f"  {name:<32} {seconds:8.3f} s {memory}".rstrip())
+    finally:
+        shutil.rmtree(temporary_path)
+
+    app.shutdown()
+
+    report = {"environment": _get_environment(), "results": results}
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not _compare(baseline, report, args.tolerance):
+            return 1
+
+    return 0
+
+
+class _Pipeline:
+    """The stages of merging synthetic data, in order.
+
+    Each stage uses the results of the previous stages, which are stored in
+    attributes.
+    """
+
+    def __init__(self, paths: dict[str, str], cache_path: str) -> None:
+        """Initialise the instance.
+
+        :param paths: The paths to the synthetic data (see `_generate_data`).
+        :param cache_path: The directory to cache loaded data and save merged
+            data in.
+        """
+        self.__cache_path = cache_path
+        self.__paths = paths
+
+        self.__brillouin_data: SizedData | None = None
+        self.__image: np.ndarray | None = None
+        self.__laser: Laser | None = None
+        self.__profilometer_data: SizedData | None = None
+        self.__aligned_brillouin_data: np.ndarray | None = None
+        self.__aligned_profilometer_data: np.ndarray | None = None
+
+        self.stages: list[tuple[str, Callable[[], None]]] = [
+            ("load elemental data", self.__load_elemental_data),
+            ("load profilometer data", self.__load_profilometer_data),
+            ("load Brillouin data", self.__load_brillouin_data),
+            ("cache profilometer data", self.__cache_profilometer_data),
+            ("load cached profilometer data", self.__load_cached_profilometer_data),
+            ("manipulate profilometer data", self.__manipulate_profilometer_data),
+            ("draw image zoomed out", self.__draw_image_zoomed_out),
+            ("draw image at actual size", self.__draw_image_at_actual_size),
+            ("align profilometer data", self.__align_profilometer_data),
+            ("align Brillouin data", self.__align_brillouin_data),
+            ("add aligned data", self.__add_aligned_data),
+            ("save compressed", self.__save_compressed),
+            ("save uncompressed", self.__save_uncompressed),
+        ]
+
+    def __load_elemental_data(self) -> None:
+        self.__laser = load_npz(self.__paths["elemental"])
+
+    def __load_profilometer_data(self) -> None:
+        self.__profilometer_data = profilometer.load(self.__paths["profilometer"])
+
+    def __load_brillouin_data(self) -> None:
+        self.__brillouin_data = brillouin.load(self.__paths["brillouin"])
+
+    def __cache_profilometer_data(self) -> None:
+        # Remove any entry written by a previous run so this is a cache miss.
+        shutil.rmtree(self.__cache_path, ignore_errors=True)
+        cache.load(
+            self.__paths["profilometer"],
+            profilometer.load,
+            cache_path=self.__cache_path,
+        )
+
+    def __load_cached_profilometer_data(self) -> None:
+        # The wizard uses cached data from here on, as it's memory-mapped.
+        self.__profilometer_data = cache.load(
+            self.__paths["profilometer"],
+            profilometer.load,
+            cache_path=self.__cache_path,
+        )
+
+    def __manipulate_profilometer_data(self) -> None:
+        assert self.__laser is not None and self.__profilometer_data is not None
+        self.__image = DataManipulator(
+            self.__profilometer_data.element_size,
+            self.__laser,
+            1,
+            self.__profilometer_data,
+        ).compute()
+
+    def __draw_image_zoomed_out(self) -> None:
+        assert self.__image is not None
+        self.__draw_image(
+            QtCore.QRectF(0, 0, self.__image.shape[1], self.__image.shape[0])
+        )
+
+    def __draw_image_at_actual_size(self) -> None:
+        self.__draw_image(QtCore.QRectF(0, 0, _VIEWPORT_SIZE, _VIEWPORT_SIZE))
+
+    def __draw_image(self, source: QtCore.QRectF) -> None:
+        """Draws part of the image into a viewport, as an alignment view does.
+
+        :param source: The part of the image to draw, in image pixels.
+        """
+        assert self.__image is not None
+        scene = QtWidgets.QGraphicsScene()
+        scene.addItem(TiledImageItem(self.__image, turbo_color_table))
+
+        viewport = QtGui.QImage(
+            _VIEWPORT_SIZE,
+            _VIEWPORT_SIZE,
+            QtGui.QImage.Format.Format_ARGB32_Premultiplied,
+        )
+        painter = QtGui.QPainter(viewport)
+        scene.render(painter, QtCore.QRectF(viewport.rect()), source)
+        painter.end()
+
+    def __align_profilometer_data(self) -> None:
+        assert self.__laser is not None and self.__profilometer_data is not None
+        self.__aligned_profilometer_data = align_data(
+            self.__laser,
+            self.__profilometer_data,
+            Alignment(None, (10.5, -20.25), 1),
+        )
+
+    def __align_brillouin_data(self) -> None:
+        assert self.__laser is not None and self.__brillouin_data is not None
+        self.__aligned_brillouin_data = align_data(
+            self.__laser, self.__brillouin_data, Alignment(None, (-3.0, 7.5), 0)
+        )
+
+    def __add_aligned_data(self) -> None:
+        assert (
+            self.__laser is not None
+            and self.__aligned_brillouin_data is not None
+            and self.__aligned_profilometer_data is not None
+        )
+        add_aligned_data(self.__laser, "Brillouin", self.__aligned_brillouin_data)
+        add_aligned_data(self.__laser, "Profilometer", self.__aligned_profilometer_data)
+
+    def __save_compressed(self) -> None:
+        assert self.__laser is not None
+        npz.save(os.path.join(self.__cache_path, "merged.npz"), self.__laser)
+
+    def __save_uncompressed(self) -> None:
+        assert self.__laser is not None
+        npz.save(
+            os.path.join(self.__cache_path, "merged.npz"),
+            self.__laser,
+            compressed=False,
+        )
+
+
+def _compare(
+    baseline: dict[str, Any], report: dict[str, Any], tolerance: float
+) -> bool:
+    """Prints how the time taken by each stage has changed since a previous
+    report.
+
+    :return: Whether no stage is slower by more than `tolerance`.
+    """
+    baseline_seconds = {
+        (result["size"], result["stage"]): result["seconds"]
+        for result in baseline["results"]
+    }
+
+    print("\nChanges since the compared report:")
+    passed = True
+    for result in report["results"]:
+        key = (result["size"], result["stage"])
+        if key not in baseline_seconds:
+            continue
+
+        before = baseline_seconds[key]
+        after = result["seconds"]
+        change = (after - before) / before if before > 0 else 0
+        regressed = (
+            after > before * (1 + tolerance) and after - before > _MINIMUM_REGRESSION
+        )
+        passed = passed and not regressed
+
+        flag = "  (regression)" if regressed else ""
+        print(
+            f"  {result['size']:>6} {result['stage']:<32}"
+            f" {before:8.3f} s -> {after:8.3f} s {change:+7.1%}{flag}"
+        )
+
+    return passed
+
+
+def _generate_data(data_path: str, size: int) -> dict[str, str]:
+    """Generates synthetic data, unless it already exists.
+
+    :param data_path: The directory to write the data to.
+    :param size: The width and height of the elemental and profilometer data.
+    :return: The paths to the "elemental", "profilometer", and "brillouin" data.
+    """
+    paths = {
+        "brillouin": os.path.join(data_path, f"brillouin-{size}.xlsx"),
+        "elemental": os.path.join(data_path, f"elemental-{size}.npz"),
+        "profilometer": os.path.join(data_path, f"profilometer-{size}.txt"),
+    }
+    rng = np.random.default_rng(size)
+
+    if not os.path.exists(paths["elemental"]):
+        data = np.empty(
+            (size, size), dtype=[(element, np.float64) for element in _ELEMENTS]
+        )
+        for element in _ELEMENTS:
+            data[element] = rng.gamma(2, 100, (size, size))
+
+        # 5 µm pixels.
+        config = Config(spotsize=5, speed=50, scantime=0.1)
+        _write_atomically(
+            paths["elemental"],
+            lambda path: save_pewlib_npz(path, Laser(data, config=config)),
+        )
+
+    if not os.path.exists(paths["profilometer"]):
+
+        def write_profilometer_data(path: str) -> None:
+            data = _make_surface(rng, size)
+
+            # Some measurements are invalid (see datamerger.io.profilometer).
+            data[rng.random(data.shape) < 0.001] = float("-3.4028235E+38")
+
+            with open(path, "w") as f:
+                f.write("numCols\tnumRows\tpixelSize (um)\n")
+                f.write(f"{size}\t{size}\t5\n")
+                f.write("\n")
+                np.savetxt(f, data, "%.4f", "\t")
+
+        _write_atomically(paths["profilometer"], write_profilometer_data)
+
+    if not os.path.exists(paths["brillouin"]):
+
+        def write_brillouin_data(path: str) -> None:
+            _write_spreadsheet(path, 5 + _make_surface(rng, max(1, size // 10)) / 100)
+
+        _write_atomically(paths["brillouin"], write_brillouin_data)
+
+    return paths
+
+
+def _get_environment() -> dict[str, Any]:
+    """Returns details of the environment the benchmarks were run in, so
+    reports from different machines or versions can be told apart."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            text=True,
+        ).stdout.strip()
+    except:
+        commit = None
+
+    return {
+        "commit": commit,
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+
+
+def _make_surface(rng: np.random.Generator, size: int) -> np.ndarray:
+    """Returns a smooth random surface, like a profilometer scan."""
+    x = np.linspace(0, 4 * np.pi, size)
+    surface = np.sin(x)[np.newaxis, :] * np.cos(x / 2)[:, np.newaxis] * 50
+    return surface + rng.normal(0, 1, (size, size))
+
+
+def _measure(
+    stage: Callable[[], None], measure_memory: bool
+) -> tuple[float, int | None]:
+    """Runs a stage and returns the time it took in seconds and, optionally, the
+    peak memory in bytes allocated by Python and NumPy while it ran again."""
+    gc.collect()
+    start = time.perf_counter()
+    stage()
+    seconds = time.perf_counter() - start
+
+    if not measure_memory:
+        return seconds, None
+
+    # Tracing slows Python code down, so it's only done when measuring memory.
+    gc.collect()
+    tracemalloc.start()
+    try:
+        stage()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return seconds, peak_memory
+
+
+def _write_atomically(path: str, write: Callable[[str], None]) -> None:
+    """Writes a file via a temporary path, so an interrupted run doesn't leave a
+    partial file to be reused."""
+    directory, name = os.path.split(path)
+    temporary_path = os.path.join(directory, f".{name}")
+    write(temporary_path)
+    os.replace(temporary_path, path)
+
+
+def _write_spreadsheet(path: str, data: np.ndarray) -> None:
+    """Writes data to the first sheet of a minimal Excel spreadsheet."""
+    columns = []
+    for i in range(data.shape[1]):
+        name = ""
+        i += 1
+        while i > 0:
+            i, remainder = divmod(i - 1, 26)
+            name = chr(ord("A") + remainder) + name
+        columns.append(name)
+
+    namespace = "http://schemas.openxmlformats.org"
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr(
+            "[Content_Types].xml",
+            f'<Types xmlns="{namespace}/package/2006/content-types">'
+            '<Default Extension="rels"'
+            ' ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/'
+            'vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/'
+            'vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+            "</Types>",
+        )
+        zip_file.writestr(
+            "_rels/.rels",
+            f'<Relationships xmlns="{namespace}/package/2006/relationships">'
+            f'<Relationship Id="rId1" Type="{namespace}/officeDocument/2006/'
+            'relationships/officeDocument" Target="xl/workbook.xml"/>'
+            "</Relationships>",
+        )
+        zip_file.writestr(
+            "xl/workbook.xml",
+            f'<workbook xmlns="{namespace}/spreadsheetml/2006/main"'
+            f' xmlns:r="{namespace}/officeDocument/2006/relationships">'
+            '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets>'
+            "</workbook>",
+        )
+        zip_file.writestr(
+            "xl/_rels/workbook.xml.rels",
+            f'<Relationships xmlns="{namespace}/package/2006/relationships">'
+            f'<Relationship Id="rId1" Type="{namespace}/officeDocument/2006/'
+            'relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+            "</Relationships>",
+        )
+        with zip_file.open("xl/worksheets/sheet1.xml", "w") as f:
+            f.write(
+                f'<worksheet xmlns="{namespace}/spreadsheetml/2006/main"><sheetData>'.encode()
+            )
+            for i, row in enumerate(data, 1):
+                cells = "".join(
+                    f'<c r="{column}{i}"><v>{value!r}</v></c>'
+                    for column, value in zip(columns, row.tolist())
+                )
+                f.write(f'<row r="{i}">{cells}</row>'.encode())
+            f.write(b"</sheetData></worksheet>")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
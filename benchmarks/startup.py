@@ -0,0 +1,130 @@
+"""Measures how long the application takes to start.
+
+Each run starts a new Python process that imports the wizard, creates it, shows
+it, and runs the event loop until the window has been painted. The time from
+starting the process to the first paint is reported, along with the modules that
+take longest to import (from `python -X importtime`).
+
+Run from the repository root:
+
+    python benchmarks/startup.py
+
+The exit status is 1 if the median time exceeds the threshold, so it can be used
+to catch regressions.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Shows the wizard and exits once it has been painted. The window is only
+# painted from the event loop, so this measures the time until the user sees it.
+_SHOW_WIZARD = """
+from PySide6 import QtCore, QtWidgets
+
+from datamerger.wizard import Wizard
+
+
+class PaintFilter(QtCore.QObject):
+    def eventFilter(self, watched, event):
+        if event.type() == QtCore.QEvent.Type.Paint:
+            app.quit()
+        return False
+
+
+app = QtWidgets.QApplication()
+wizard = Wizard()
+paint_filter = PaintFilter()
+wizard.installEventFilter(paint_filter)
+wizard.show()
+
+# Some platforms (e.g. offscreen) never paint, so don't wait forever.
+QtCore.QTimer.singleShot(10000, app.quit)
+app.exec()
+"""
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--runs", default=5, help="the number of runs (default: 5)", type=int
+    )
+    parser.add_argument(
+        "--threshold",
+        default=1.0,
+        help="the maximum acceptable median time in seconds (default: 1)",
+        type=float,
+    )
+    parser.add_argument(
+        "--top",
+        default=15,
+        help="the number of slowest imports to show (default: 15)",
+        type=int,
+    )
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    times = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", _SHOW_WIZARD], check=True, cwd=root)
+        times.append(time.perf_counter() - start)
+
+    print(f"Time to first paint over {args.runs} runs:")
+    print(f"  median {statistics.median(times):.3f} s")
+    print(f"  min    {min(times):.3f} s")
+    print(f"  max    {max(times):.3f} s")
+
+    print("\nSlowest imports (including the modules they import):")
+    for cumulative, name in _get_import_times(root)[: args.top]:
+        print(f"  {cumulative / 1e6:.3f} s  {name}")
+
+    if statistics.median(times) > args.threshold:
+        print(f"\nThe median exceeds the threshold of {args.threshold} s")
+        return 1
+
+    return 0
+
+
+def _get_import_times(root: str) -> list[tuple[int, str]]:
+    """Returns the cumulative import time in µs of each module imported while
+    importing the wizard, slowest first.
+
+    Only modules imported directly by the wizard's package or the top level are
+    included, since the modules they import are already counted.
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import datamerger.wizard"],
+        capture_output=True,
+        check=True,
+        cwd=root,
+        text=True,
+    )
+
+    # Lines look like "import time: self [us] | cumulative | name", where the
+    # name is indented by two spaces per level and follows the lines of the
+    # modules it imports. Reversed, each module follows its importers.
+    import_times = []
+    importers: list[str] = []
+    for line in reversed(process.stderr.splitlines()):
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+
+        _, cumulative, name = line.split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+
+        del importers[depth:]
+        if len(importers) == 0 or importers[-1].startswith("datamerger"):
+            import_times.append((int(cumulative), name))
+        importers.append(name)
+
+    return sorted(import_times, reverse=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""Merges many samples in parallel.
+
+Samples are listed in a CSV or JSON manifest. Each sample has the following
+fields, of which only `elemental` and `output` are required:
+
+- `elemental`: the path to the pew² .npz file.
+- `output`: where to save the merged .npz file.
+- `brillouin` and `profilometer`: the paths to the other data.
+- `brillouin_element_size` and `profilometer_element_size`: the size of each
+  element of the other data in µm.
+- `brillouin_x`, `brillouin_y`, `profilometer_x`, and `profilometer_y`: the
+  position of the other data relative to the elemental data.
+- `brillouin_rotation` and `profilometer_rotation`: the number of 90°
+  counter-clockwise rotations to apply to the other data.
+
+A CSV manifest has a header row containing the field names, and empty cells are
+treated as missing fields. A JSON manifest is a list of objects.
+
+Relative paths are relative to the directory containing the manifest.
+
+The outcome of each sample is appended to a journal file as it completes. When a
+batch is run again, samples that were successfully merged are skipped, so a
+batch that was interrupted can be resumed.
+"""
+
+import concurrent.futures
+import csv
+import json
+import logging
+import os
+from dataclasses import dataclass
+from typing import Any
+
+from datamerger.merge import Alignment, merge_files
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Sample:
+    """A sample to merge. See `merge_files` for a description of the fields."""
+
+    elemental_data_path: str
+    output_path: str
+    brillouin_data_path: str
+    brillouin_alignment: Alignment
+    profilometer_data_path: str
+    profilometer_alignment: Alignment
+
+
+def load_manifest(path: str) -> list[Sample]:
+    """Loads the samples listed in a manifest.
+
+    :param path: The path to the manifest. Files with a .json extension are
+        parsed as JSON, others as CSV.
+    :return: The samples, in the order they're listed.
+    """
+    with open(path, newline="") as f:
+        if os.path.splitext(path)[1].lower() == ".json":
+            rows = json.load(f)
+            assert isinstance(rows, list), "A JSON manifest must contain a list"
+        else:
+            rows = [
+                {key: value for key, value in row.items() if value != ""}
+                for row in csv.DictReader(f)
+            ]
+
+    directory = os.path.dirname(os.path.abspath(path))
+    return [_make_sample(row, directory) for row in rows]
+
+
+def run_batch(
+    samples: list[Sample],
+    journal_path: str,
+    workers: int | None,
+    compressed: bool = True,
+) -> int:
+    """Merges samples in parallel, skipping those that were previously merged.
+
+    :param samples: The samples to merge.
+    :param journal_path: The path to the journal that records the outcome of
+        each sample.
+    :param workers: The number of worker processes, or None to use one per CPU.
+    :param compressed: Whether to compress the output files.
+    :return: The number of samples that failed to merge.
+    """
+    merged_output_paths = _read_journal(journal_path)
+    pending_samples = []
+    for sample in samples:
+        if sample.output_path in merged_output_paths and os.path.exists(
+            sample.output_path
+        ):
+            logger.info(f"Skipping {sample.output_path} as it was already merged")
+        else:
+            pending_samples.append(sample)
+
+    failures = 0
+    with (
+        open(journal_path, "a") as journal,
+        concurrent.futures.ProcessPoolExecutor(workers) as executor,
+    ):
+        # Start a new line in case the last entry was only partially written.
+        if journal.tell() > 0:
+            journal.write("\n")
+
+        futures = {
+            executor.submit(_merge_sample, sample, compressed): sample
+            for sample in pending_samples
+        }
+        for future in concurrent.futures.as_completed(futures):
+            sample = futures[future]
+            entry: dict[str, Any] = {"output": sample.output_path}
+
+            try:
+                future.result()
+                entry["status"] = "success"
+                logger.info(f"Merged {sample.output_path}")
+            except Exception as e:
+                entry["error"] = f"{type(e).__name__}: {e}"
+                entry["status"] = "failure"
+                failures += 1
+                logger.error(f"Failed to merge {sample.output_path}: {entry['error']}")
+
+            # Flush each entry so it survives a crash of this process.
+            journal.write(json.dumps(entry) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+
+    logger.info(
+        f"{len(pending_samples) - failures} merged, {failures} failed,"
+        f" {len(samples) - len(pending_samples)} skipped"
+    )
+    return failures
+
+
+def _make_sample(row: dict[str, Any], directory: str) -> Sample:
+    def get_path(key: str) -> str:
+        value = row.get(key, "")
+        return "" if value == "" else os.path.join(directory, value)
+
+    def get_alignment(name: str) -> Alignment:
+        element_size = row.get(f"{name}_element_size")
+        return Alignment(
+            None if element_size is None else float(element_size),
+            (float(row.get(f"{name}_x", 0)), float(row.get(f"{name}_y", 0))),
+            int(row.get(f"{name}_rotation", 0)),
+        )
+
+    assert "elemental" in row and "output" in row, f"Invalid sample: {row}"
+    return Sample(
+        get_path("elemental"),
+        get_path("output"),
+        get_path("brillouin"),
+        get_alignment("brillouin"),
+        get_path("profilometer"),
+        get_alignment("profilometer"),
+    )
+
+
+def _merge_sample(sample: Sample, compressed: bool) -> None:
+    merge_files(
+        sample.elemental_data_path,
+        sample.output_path,
+        brillouin_data_path=sample.brillouin_data_path,
+        brillouin_alignment=sample.brillouin_alignment,
+        profilometer_data_path=sample.profilometer_data_path,
+        profilometer_alignment=sample.profilometer_alignment,
+        compressed=compressed,
+    )
+
+
+def _read_journal(path: str) -> set[str]:
+    """Returns the output paths of samples the journal says were merged."""
+    output_paths: set[str] = set()
+    if not os.path.exists(path):
+        return output_paths
+
+    with open(path) as f:
+        for line in f:
+            # The last line may be incomplete if the process crashed.
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+            if entry["status"] == "success":
+                output_paths.add(entry["output"])
+            else:
+                output_paths.discard(entry["output"])
+
+    return output_paths
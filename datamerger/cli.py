@@ -0,0 +1,144 @@
+"""The command line interface.
+
+It provides access to the merging functionality without starting the wizard.
+"""
+
+import argparse
+import logging
+
+from datamerger import batch, config, instrumentation
+from datamerger.merge import Alignment, merge_files
+
+logger = logging.getLogger(__name__)
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Runs the command line interface.
+
+    :param argv: The command line arguments, excluding the program name. If
+        None, `sys.argv` is used.
+    :return: The exit status.
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m datamerger", description=config.PROGRAM_NAME
+    )
+    instrumentation.add_arguments(parser)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    merge_parser = subparsers.add_parser(
+        "merge",
+        description="Adds Brillouin and/or profilometer data to an existing pew²"
+        ' .npz file as additional "elements".',
+        help="merge one sample",
+    )
+    merge_parser.add_argument("elemental", help="the pew² .npz file")
+    merge_parser.add_argument("output", help="where to save the merged .npz file")
+    _add_data_arguments(merge_parser, "brillouin", "Brillouin")
+    _add_data_arguments(merge_parser, "profilometer", "profilometer")
+    _add_output_arguments(merge_parser)
+    merge_parser.set_defaults(run=_run_merge)
+
+    batch_parser = subparsers.add_parser(
+        "batch",
+        description="Merges the samples listed in a CSV or JSON manifest in"
+        " parallel. See datamerger/batch.py for the manifest format.",
+        help="merge many samples",
+    )
+    batch_parser.add_argument("manifest", help="the CSV or JSON manifest")
+    batch_parser.add_argument(
+        "--journal",
+        help="where to record the outcome of each sample, used to skip samples"
+        " that were merged by a previous run (default: the manifest path with"
+        " .journal appended)",
+        metavar="PATH",
+    )
+    batch_parser.add_argument(
+        "--workers",
+        help="the number of worker processes (default: one per CPU)",
+        metavar="N",
+        type=int,
+    )
+    _add_output_arguments(batch_parser)
+    batch_parser.set_defaults(run=_run_batch)
+
+    logging.basicConfig(level=logging.INFO)
+    args = parser.parse_args(argv)
+    instrumentation.enable_from_arguments(args)
+    return args.run(parser, args)
+
+
+def _add_data_arguments(
+    parser: argparse.ArgumentParser, name: str, data_type: str
+) -> None:
+    group = parser.add_argument_group(f"{data_type} data")
+    group.add_argument(
+        f"--{name}", default="", help=f"the {data_type} data", metavar="PATH"
+    )
+    group.add_argument(
+        f"--{name}-element-size",
+        help=f"the size of each element of the {data_type} data in µm (default: the"
+        " size recorded in the data)",
+        metavar="UM",
+        type=float,
+    )
+    group.add_argument(
+        f"--{name}-position",
+        default=(0, 0),
+        help=f"the position of the top-left corner of the rotated and resampled"
+        f" {data_type} data relative to the elemental data, in elemental data"
+        " pixels (default: 0 0)",
+        metavar=("X", "Y"),
+        nargs=2,
+        type=float,
+    )
+    group.add_argument(
+        f"--{name}-rotation",
+        default=0,
+        help=f"the number of 90° counter-clockwise rotations to apply to the"
+        f" {data_type} data (default: 0)",
+        metavar="N",
+        type=int,
+    )
+
+
+def _add_output_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--uncompressed",
+        action="store_true",
+        help="don't compress the output, which is much faster to save but"
+        " results in larger files",
+    )
+
+
+def _run_batch(parser: argparse.ArgumentParser, args: argparse.Namespace) -> int:
+    samples = batch.load_manifest(args.manifest)
+    journal_path = args.journal or f"{args.manifest}.journal"
+    failures = batch.run_batch(
+        samples, journal_path, args.workers, not args.uncompressed
+    )
+    return 1 if failures > 0 else 0
+
+
+def _get_alignment(args: argparse.Namespace, name: str) -> Alignment:
+    return Alignment(
+        getattr(args, f"{name}_element_size"),
+        tuple(getattr(args, f"{name}_position")),
+        getattr(args, f"{name}_rotation"),
+    )
+
+
+def _run_merge(parser: argparse.ArgumentParser, args: argparse.Namespace) -> int:
+    if args.brillouin == "" and args.profilometer == "":
+        parser.error("at least one of --brillouin or --profilometer is required")
+
+    merge_files(
+        args.elemental,
+        args.output,
+        brillouin_data_path=args.brillouin,
+        brillouin_alignment=_get_alignment(args, "brillouin"),
+        profilometer_data_path=args.profilometer,
+        profilometer_alignment=_get_alignment(args, "profilometer"),
+        compressed=not args.uncompressed,
+    )
+    logger.info(f"Saved merged data to {args.output}")
+    return 0
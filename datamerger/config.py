@@ -1,2 +1,59 @@
+import os
+
 # The name of the application to be shown in the UI.
 PROGRAM_NAME = "Data merger"
+
+# The directory in which parsed input files are cached. It can be overridden
+# with the DATAMERGER_CACHE_PATH environment variable.
+CACHE_PATH = os.environ.get(
+    "DATAMERGER_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "datamerger"),
+)
+
+# The maximum total size of the cache in bytes. When it's exceeded the least
+# recently used entries are evicted.
+CACHE_SIZE = 4 * 1024**3
+
+# Whether to include a hash of each input file's contents in its cache key. This
+# protects against files being modified without their size or modification time
+# changing, but means each input file must be read in full to load it from the
+# cache.
+CACHE_HASH_CONTENTS = False
+
+# Profilometer data that's much finer than the elemental data has its resolution
+# reduced as it's loaded, by averaging square blocks of elements, so it uses
+# less memory and is quicker to rotate and resample. This is the minimum number
+# of elements to keep per elemental data pixel width, even at the largest
+# element size the user can choose when aligning the data, or 0 to always load
+# the data at full resolution. It can be overridden with the
+# DATAMERGER_LOAD_RESOLUTION environment variable.
+LOAD_RESOLUTION = float(os.environ.get("DATAMERGER_LOAD_RESOLUTION", "2"))
+
+# The maximum total size in bytes of the images of rotated and resampled data
+# that each alignment view keeps in memory, so revisiting an element size and
+# rotation doesn't recalculate them.
+MANIPULATED_IMAGE_CACHE_SIZE = 512 * 1024**2
+
+# The maximum total size in bytes of the tiles that each image in an alignment
+# view keeps in memory. Tiles that aren't in the cache are recreated when
+# they're next drawn.
+TILE_CACHE_SIZE = 64 * 1024**2
+
+# The maximum total size in bytes of the images of elements of elemental data
+# that are kept in memory, shared by the alignment views.
+ELEMENT_IMAGE_CACHE_SIZE = 512 * 1024**2
+
+# The dtype in which other data is rotated, resampled, and drawn in the alignment
+# views, e.g. "float32" or "float64". float32 halves the memory used and is more
+# than precise enough for display. It doesn't affect the merged data, which is
+# computed at the precision of the elemental data. It can be overridden with
+# the DATAMERGER_COMPUTE_DTYPE environment variable.
+COMPUTE_DTYPE = os.environ.get("DATAMERGER_COMPUTE_DTYPE", "float32")
+
+# The path of a Chrome trace file to record how long slow operations take in,
+# and the directory to write cProfile statistics for each of them to. Setting
+# either enables instrumentation (see datamerger.instrumentation). They can be
+# overridden with the DATAMERGER_TRACE_PATH and DATAMERGER_PROFILE_PATH
+# environment variables or the --trace and --profile options.
+TRACE_PATH = os.environ.get("DATAMERGER_TRACE_PATH", "")
+PROFILE_PATH = os.environ.get("DATAMERGER_PROFILE_PATH", "")
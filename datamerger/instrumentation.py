@@ -0,0 +1,220 @@
+"""Opt-in measurement of slow operations, such as loading and saving data.
+
+When instrumentation is enabled (see `enable`), each operation wrapped in
+`measure` is logged along with its wall time, CPU time, the most memory it
+allocated at once, and the net change in memory. Measurements can also be
+written to a trace file, which can be viewed with chrome://tracing or
+https://ui.perfetto.dev, and each operation can be profiled with cProfile.
+
+Only one operation is profiled at a time, as only one profiler can be active in
+a process, so operations that run while another is profiled (including those
+nested in it) aren't profiled separately. Likewise, tracemalloc's peak is shared
+by the whole process, so the peak memory of only one operation is measured at a
+time.
+
+When instrumentation is disabled, measuring an operation has negligible
+overhead.
+"""
+
+import argparse
+import contextlib
+import cProfile
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from typing import Iterator
+
+from datamerger import config
+
+logger = logging.getLogger(__name__)
+
+# Whether operations are measured.
+_enabled = False
+
+# The directory to write cProfile statistics to, or "" to not profile.
+_profile_path = ""
+
+# Numbers the files of cProfile statistics so they don't overwrite each other.
+_profile_numbers = itertools.count()
+
+# Held while an operation is profiled, as since Python 3.12 enabling a profiler
+# while another is active raises a ValueError.
+_profile_lock = threading.Lock()
+
+# Held while an operation's peak memory is measured, as measuring it resets
+# tracemalloc's peak, which would disrupt the measurement of another operation.
+_peak_memory_lock = threading.Lock()
+
+# The file descriptor of the trace file, or None if no trace is being written.
+_trace_fd: int | None = None
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Adds command line options that enable instrumentation (see
+    `enable_from_arguments`).
+
+    The options default to the corresponding environment variables (see
+    `config.TRACE_PATH` and `config.PROFILE_PATH`).
+    """
+    group = parser.add_argument_group("instrumentation")
+    group.add_argument(
+        "--trace",
+        default=config.TRACE_PATH,
+        help="log how long slow operations take and record them in a Chrome"
+        " trace file at PATH",
+        metavar="PATH",
+    )
+    group.add_argument(
+        "--profile",
+        default=config.PROFILE_PATH,
+        help="log how long slow operations take and profile each one with"
+        " cProfile, writing the statistics to DIRECTORY",
+        metavar="DIRECTORY",
+    )
+
+
+def enable(trace_path: str = "", profile_path: str = "") -> None:
+    """Enables instrumentation.
+
+    Measurements are logged at the INFO level. Memory allocations are traced
+    with tracemalloc in order to measure them, which slows Python code down.
+
+    :param trace_path: The path to write a trace to in Chrome's trace event
+        format, or "" for none. Events are written as operations finish, so the
+        trace is usable even if the application hangs or crashes.
+    :param profile_path: The directory to write cProfile statistics for each
+        operation to, or "" to not profile.
+    """
+    global _enabled, _profile_path, _trace_fd
+
+    if trace_path != "":
+        # The JSON array format doesn't require the closing bracket, so events
+        # can be appended. Each is written with a single write so events from
+        # other threads (or processes) aren't interleaved.
+        _trace_fd = os.open(
+            trace_path, os.O_APPEND | os.O_CREAT | os.O_TRUNC | os.O_WRONLY, 0o666
+        )
+        os.write(_trace_fd, b"[\n")
+
+    if profile_path != "":
+        os.makedirs(profile_path, exist_ok=True)
+    _profile_path = profile_path
+
+    tracemalloc.start()
+    _enabled = True
+
+
+def enable_from_arguments(args: argparse.Namespace) -> bool:
+    """Enables instrumentation if it was requested by the options added by
+    `add_arguments`.
+
+    :param args: The parsed command line arguments.
+    :return: Whether instrumentation was enabled.
+    """
+    if args.trace == "" and args.profile == "":
+        return False
+
+    enable(args.trace, args.profile)
+    return True
+
+
+def mark(name: str, **details: object) -> None:
+    """Records that something happened, e.g. the user moved to another page.
+
+    :param name: What happened.
+    :param details: Details to record, e.g. the page.
+    """
+    if not _enabled:
+        return
+
+    logger.info(
+        ", ".join([name, *[f"{key}={value}" for key, value in details.items()]])
+    )
+    _write_event({"name": name, "ph": "i", "s": "p", "args": details})
+
+
+@contextlib.contextmanager
+def measure(name: str, **details: object) -> Iterator[None]:
+    """Measures an operation, if instrumentation is enabled.
+
+    The CPU time is that of the calling thread. The peak memory allocated is the
+    most memory in use at once while the operation ran, relative to when it
+    started. It's only measured if no other operation's peak memory is being
+    measured (e.g. it's not nested in another operation). The net memory change
+    is the memory in use when the operation finished, relative to when it
+    started, so it's negative if the operation freed memory. Both include
+    allocations by other threads that run at the same time.
+
+    :param name: The name of the operation, e.g. "LoadProfilometerData".
+    :param details: Details of the operation to record, e.g. the path of a file.
+    """
+    if not _enabled:
+        yield
+        return
+
+    profile = None
+    if _profile_path != "" and _profile_lock.acquire(blocking=False):
+        profile = cProfile.Profile()
+        profile.enable()
+
+    measure_peak_memory = _peak_memory_lock.acquire(blocking=False)
+    if measure_peak_memory:
+        tracemalloc.reset_peak()
+    start_memory, _ = tracemalloc.get_traced_memory()
+    start_cpu_time = time.thread_time()
+    start_time = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter_ns() - start_time
+        cpu_time = time.thread_time() - start_cpu_time
+        memory, peak_memory = tracemalloc.get_traced_memory()
+        if measure_peak_memory:
+            _peak_memory_lock.release()
+
+        if profile is not None:
+            try:
+                profile.disable()
+                profile.dump_stats(
+                    os.path.join(
+                        _profile_path,
+                        f"{os.getpid()}-{next(_profile_numbers)}-{name}.prof",
+                    )
+                )
+            finally:
+                _profile_lock.release()
+
+        memory_change = memory - start_memory
+        measurements: dict[str, object] = {"cpu_time": cpu_time}
+        message = f"{name} took {duration / 1e9:.3f} s ({cpu_time:.3f} s of CPU time,"
+        if measure_peak_memory:
+            peak_allocated = peak_memory - start_memory
+            measurements["peak_allocated"] = peak_allocated
+            message += f" {peak_allocated / 2**20:.1f} MiB allocated at peak,"
+        measurements["memory_change"] = memory_change
+        logger.info(f"{message} {memory_change / 2**20:+.1f} MiB net memory change)")
+        _write_event(
+            {
+                "name": name,
+                "ph": "X",
+                "ts": start_time / 1000,
+                "dur": duration / 1000,
+                "args": {**measurements, **details},
+            }
+        )
+
+
+def _write_event(event: dict[str, object]) -> None:
+    """Appends an event to the trace file, if there is one."""
+    if _trace_fd is None:
+        return
+
+    # Instant events have a timestamp of now.
+    event.setdefault("ts", time.perf_counter_ns() / 1000)
+    event["pid"] = os.getpid()
+    event["tid"] = threading.get_ident()
+    os.write(_trace_fd, f"{json.dumps(event, default=str)},\n".encode())
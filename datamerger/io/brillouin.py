@@ -1,15 +1,399 @@
+import codecs
+import itertools
+import math
+import os
+import posixpath
+import re
+import zipfile
+from array import array
+from typing import IO, Callable
+from xml.etree import ElementTree
+from xml.parsers import expat
+
 import numpy as np
-import pandas as pd
 
+from .cancelled import Cancelled
 from .sized_data import SizedData
 
+# The number of lines to read from a CSV/TSV file and convert to floats at a
+# time (see `datamerger.io.profilometer`).
+_BLOCK_ROWS = 256
+
+# The delimiters of the supported plain text formats, keyed by file extension.
+# Files with any other extension are assumed to be Excel spreadsheets.
+_DELIMITERS = {".csv": ",", ".tsv": "\t"}
+
+# The number of bytes of a sheet's XML to match at a time.
+_SHEET_BLOCK_SIZE = 1024 * 1024
+
+# Matches a cell of a sheet written in the usual way, capturing its column,
+# row, type, value, and inline string, e.g. `<c r="B3" t="n"><v>1.5</v></c>`.
+# Groups that aren't present are empty.
+_CELL_PATTERN = re.compile(
+    r'<c r="([A-Z]+)([0-9]+)"(?: s="[0-9]+")?(?: t="(\w+)")?(?: s="[0-9]+")?\s*'
+    r"(?:/>|>(?:<f>[^<]*</f>)?(?:<v>([^<]*)</v>|<v ?/>|<is><t>([^<]*)</t></is>)?</c>)"
+)
+
+# The XML namespaces used by Excel spreadsheets.
+_MAIN_NAMESPACE = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_RELATIONSHIPS_NAMESPACE = (
+    "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+)
 
-def load(path: str) -> SizedData:
-    """Loads Brillouin data from an Excel spreadsheet.
+
+def load(
+    path: str,
+    on_progress: Callable[[float], None] | None = None,
+    is_cancelled: Callable[[], bool] | None = None,
+) -> SizedData:
+    """Loads Brillouin data from an Excel spreadsheet or a CSV/TSV file.
 
     Each element is assumed to have a size of 50µm.
 
-    :param path: The path to the Brillouin data.
+    The data is read from the first sheet of a spreadsheet, starting at cell
+    A1. Empty cells are NaN, and empty rows and columns after the data are
+    ignored.
+
+    :param path: The path to the Brillouin data. Files ending in ".csv" or
+        ".tsv" are read as comma- or tab-separated values respectively.
+    :param on_progress: Called with the fraction of the file that has been
+        read, from 0 to 1, as it's read. For spreadsheets this is the fraction
+        of the sheet.
+    :param is_cancelled: Called after each block of the file is read. If it
+        returns True, `Cancelled` is raised rather than reading the rest of the
+        file.
     :return: The Brillouin data contained within the file at `path`.
     """
-    return SizedData(pd.read_excel(path, dtype=np.float64, header=None).to_numpy(), 50)
+
+    def on_block(fraction: float) -> None:
+        if on_progress is not None:
+            on_progress(fraction)
+        if is_cancelled is not None and is_cancelled():
+            raise Cancelled()
+
+    delimiter = _DELIMITERS.get(os.path.splitext(path)[1].lower())
+    if delimiter is None:
+        data = _load_spreadsheet(path, on_block)
+    else:
+        data = _load_delimited(path, delimiter, on_block)
+
+    return SizedData(data, 50)
+
+
+def _load_delimited(
+    path: str, delimiter: str, on_progress: Callable[[float], None]
+) -> np.ndarray:
+    with open(path, newline="") as f:
+        # Count the lines so the array can be allocated up front rather than
+        # concatenating blocks (which would double the peak memory usage).
+        height = sum(1 for _ in f)
+        f.seek(0)
+
+        data: np.ndarray | None = None
+        i = 0
+        line_count = 0
+        while True:
+            lines = list(itertools.islice(f, _BLOCK_ROWS))
+            if len(lines) == 0:
+                break
+
+            try:
+                block = np.loadtxt(
+                    lines, np.float64, delimiter=delimiter, ndmin=2, quotechar='"'
+                )
+            except ValueError:
+                # NumPy can't parse empty values, so fall back to converting
+                # each value in Python, which is much slower.
+                block = np.loadtxt(
+                    lines,
+                    np.float64,
+                    converters=lambda value: (
+                        float(value) if value.strip() else math.nan
+                    ),
+                    delimiter=delimiter,
+                    ndmin=2,
+                    quotechar='"',
+                )
+
+            if data is None:
+                data = np.empty((height, block.shape[1]), np.float64)
+            assert block.shape[1] == data.shape[1], "Unexpected Brillouin data shape"
+
+            # Blank lines are skipped, so there may be fewer rows than lines.
+            data[i : i + block.shape[0]] = block
+            i += block.shape[0]
+
+            line_count += len(lines)
+            on_progress(line_count / height)
+
+        assert data is not None, "The Brillouin data is empty"
+        return data[:i]
+
+
+def _load_spreadsheet(path: str, on_progress: Callable[[float], None]) -> np.ndarray:
+    """Loads the first sheet of an Excel spreadsheet."""
+    with zipfile.ZipFile(path) as zip_file:
+        shared_strings = _read_shared_strings(zip_file)
+        sheet_path = _get_first_sheet_path(zip_file)
+
+        # Progress is the fraction of the decompressed sheet that's been parsed.
+        sheet_size = max(1, zip_file.getinfo(sheet_path).file_size)
+
+        def on_read(size: int) -> None:
+            on_progress(min(1, size / sheet_size))
+
+        with zip_file.open(sheet_path) as f:
+            cells = _parse_sheet_quickly(f, shared_strings, on_read)
+        if cells is None:
+            with zip_file.open(sheet_path) as f:
+                cells = _parse_sheet(f, shared_strings, on_read)
+
+    rows, columns, values = cells
+    assert len(values) > 0, "The Brillouin data is empty"
+
+    # Place the values in an array spanning from A1 to the last non-empty
+    # cells, as pandas.read_excel did.
+    data = np.full((rows.max() + 1, columns.max() + 1), np.nan)
+    data[rows, columns] = values
+
+    return data
+
+
+def _parse_sheet_quickly(
+    f: IO[bytes], shared_strings: list[str], on_read: Callable[[int], None]
+) -> tuple[np.ndarray, np.ndarray, np.ndarray] | None:
+    """Returns the zero-based rows and columns, and the values, of the non-empty
+    cells of a sheet.
+
+    `on_read` is called with the number of bytes of the sheet read so far after
+    each block is matched.
+
+    The sheet's XML is decompressed and matched against `_CELL_PATTERN` a block
+    at a time, which is several times faster than parsing it with an XML parser
+    (see `_parse_sheet`) as no Python code is run per element. This only
+    works for sheets written in the usual way, so None is returned if any cell
+    doesn't match (e.g. it has other attributes or contains rich text).
+    """
+    all_rows = []
+    all_columns = []
+    all_values = []
+
+    # The column indices of column names.
+    column_indices: dict[str, int] = {}
+
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    text = ""
+    size = 0
+    while True:
+        block = f.read(_SHEET_BLOCK_SIZE)
+        text += decoder.decode(block, final=len(block) == 0)
+        size += len(block)
+
+        # Only match complete rows, so no cell is split between blocks.
+        if len(block) == 0:
+            end = len(text)
+        else:
+            end = text.rfind("</row>")
+            if end == -1:
+                continue
+            end += len("</row>")
+
+        cells = _CELL_PATTERN.findall(text, 0, end)
+        cell_count = sum(text.count(start, 0, end) for start in ("<c ", "<c>", "<c/>"))
+        if len(cells) != cell_count:
+            return None
+        text = text[end:]
+
+        if len(cells) > 0:
+            types = {cell[2] for cell in cells}
+            if not types <= {"", "b", "e", "inlineStr", "n", "s", "str"}:
+                return None
+
+            # A cell's value is either its value or its inline string.
+            values = [cell[3] or cell[4] for cell in cells]
+            if "s" in types:
+                values = [
+                    shared_strings[int(value)] if cell[2] == "s" else value
+                    for cell, value in zip(cells, values)
+                ]
+            if "e" in types:
+                values = [
+                    "" if cell[2] == "e" else value
+                    for cell, value in zip(cells, values)
+                ]
+
+            # Empty cells, blank strings, and cells containing errors are NaN.
+            # Converting the strings with map is much faster than converting
+            # them with NumPy.
+            if not all(values) or not types <= {"", "b", "n"}:
+                values = [value if value.strip() else "nan" for value in values]
+            floats = np.fromiter(map(float, values), np.float64, len(values))
+
+            for column in {cell[0] for cell in cells}.difference(column_indices):
+                column_indices[column] = _get_column_index(column)
+
+            # Skip cells without values, as _parse_sheet does.
+            valid = ~np.isnan(floats)
+            all_columns.append(
+                np.fromiter(
+                    map(column_indices.__getitem__, [cell[0] for cell in cells]),
+                    np.int64,
+                    len(cells),
+                )[valid]
+            )
+            all_rows.append(
+                np.fromiter(
+                    map(int, [cell[1] for cell in cells]), np.int64, len(cells)
+                )[valid]
+                - 1
+            )
+            all_values.append(floats[valid])
+
+        on_read(size)
+        if len(block) == 0:
+            break
+
+    # Cells with a namespace prefix (e.g. `<x:c>`) aren't matched or counted.
+    if len(all_values) == 0:
+        return None
+
+    return (
+        np.concatenate(all_rows),
+        np.concatenate(all_columns),
+        np.concatenate(all_values),
+    )
+
+
+def _parse_sheet(
+    f: IO[bytes], shared_strings: list[str], on_read: Callable[[int], None]
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns the zero-based rows and columns, and the values, of the non-empty
+    cells of a sheet.
+
+    The sheet's XML is parsed a block at a time as it's decompressed and each
+    cell's value is appended to compact arrays rather than creating an object
+    per cell. `on_read` is called as for `_parse_sheet_quickly`.
+    """
+    rows = array("q")
+    columns = array("q")
+    values = array("d")
+
+    # expat names elements by their namespace and name separated by "}", i.e.
+    # ElementTree's format without the leading "{".
+    cell_name = _MAIN_NAMESPACE[1:] + "c"
+    row_name = _MAIN_NAMESPACE[1:] + "row"
+    value_names = {_MAIN_NAMESPACE[1:] + "v", _MAIN_NAMESPACE[1:] + "t"}
+
+    # The state of the parser.
+    row = -1
+    column = -1
+    cell_type = ""
+    text: list[str] = []
+    in_value = False
+
+    def start_element(name: str, attributes: dict[str, str]) -> None:
+        nonlocal cell_type, column, in_value, row
+        if name == cell_name:
+            reference = attributes.get("r")
+            if reference is None:
+                column += 1
+            else:
+                column = _get_column_index(reference)
+            cell_type = attributes.get("t", "n")
+            text.clear()
+        elif name in value_names:
+            in_value = True
+        elif name == row_name:
+            number = attributes.get("r")
+            row = row + 1 if number is None else int(number) - 1
+            column = -1
+
+    def end_element(name: str) -> None:
+        nonlocal in_value
+        if name == cell_name:
+            value = "".join(text).strip()
+            if value != "" and cell_type == "s":
+                value = shared_strings[int(value)].strip()
+            if value == "" or cell_type == "e":
+                return
+
+            rows.append(row)
+            columns.append(column)
+            values.append(float(value))
+        elif name in value_names:
+            in_value = False
+
+    def character_data(data: str) -> None:
+        if in_value:
+            text.append(data)
+
+    parser = expat.ParserCreate(namespace_separator="}")
+    parser.buffer_text = True
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = character_data
+
+    size = 0
+    while block := f.read(_SHEET_BLOCK_SIZE):
+        parser.Parse(block, False)
+        size += len(block)
+        on_read(size)
+    parser.Parse(b"", True)
+
+    return (
+        np.frombuffer(rows, np.int64),
+        np.frombuffer(columns, np.int64),
+        np.frombuffer(values, np.float64),
+    )
+
+
+def _get_column_index(reference: str) -> int:
+    """Returns the zero-based column index of a cell reference, e.g. 27 for
+    "AB3"."""
+    index = 0
+    for character in reference:
+        if character.isdigit():
+            break
+        index = index * 26 + ord(character) - ord("A") + 1
+
+    return index - 1
+
+
+def _get_first_sheet_path(zip_file: zipfile.ZipFile) -> str:
+    """Returns the path within a spreadsheet of its first sheet."""
+    with zip_file.open("xl/workbook.xml") as f:
+        sheet = ElementTree.parse(f).find(
+            f"{_MAIN_NAMESPACE}sheets/{_MAIN_NAMESPACE}sheet"
+        )
+    assert sheet is not None, "The spreadsheet has no sheets"
+    relationship_id = sheet.get(f"{_RELATIONSHIPS_NAMESPACE}id")
+
+    # The sheet's path is given by the workbook's relationships.
+    with zip_file.open("xl/_rels/workbook.xml.rels") as f:
+        for relationship in ElementTree.parse(f).getroot():
+            if relationship.get("Id") == relationship_id:
+                target = relationship.get("Target", "")
+                if target.startswith("/"):
+                    return target[1:]
+                return posixpath.normpath(posixpath.join("xl", target))
+
+    raise ValueError("The spreadsheet's first sheet is missing")
+
+
+def _read_shared_strings(zip_file: zipfile.ZipFile) -> list[str]:
+    """Returns the strings that cells of a spreadsheet refer to by index."""
+    try:
+        f = zip_file.open("xl/sharedStrings.xml")
+    except KeyError:
+        return []
+
+    shared_strings = []
+    with f:
+        for _, element in ElementTree.iterparse(f):
+            if element.tag == _MAIN_NAMESPACE + "si":
+                shared_strings.append(
+                    "".join(t.text or "" for t in element.iter(_MAIN_NAMESPACE + "t"))
+                )
+                element.clear()
+
+    return shared_strings
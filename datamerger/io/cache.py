@@ -0,0 +1,196 @@
+import functools
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from typing import Callable
+
+import numpy as np
+
+from datamerger import config
+from .sized_data import SizedData
+
+logger = logging.getLogger(__name__)
+
+# Part of every cache key, so entries written by older versions aren't used.
+# Increment it whenever a loader's output changes (e.g. a parser is fixed) or
+# the format of the entries changes.
+_FORMAT_VERSION = 1
+
+
+def load(
+    path: str,
+    loader: Callable[[str], SizedData],
+    cache_path: str = config.CACHE_PATH,
+    cache_size: int = config.CACHE_SIZE,
+    hash_contents: bool = config.CACHE_HASH_CONTENTS,
+) -> SizedData:
+    """Loads data via a cache of previously loaded data.
+
+    Each cache entry consists of a `.npy` file containing the data and a `.json`
+    file containing its element size and reduction. Entries are keyed by the
+    size and modification time of the input file and, optionally, a hash of its
+    contents, along with the loader and `_FORMAT_VERSION`. The `.json` file's
+    modification time records when the entry was last used, and the least
+    recently used entries are evicted when the cache grows beyond `cache_size`.
+
+    The data returned is memory-mapped from the cache and read-only, even on a
+    cache miss, so loading an entry takes constant time and the operating
+    system can page the data out rather than it occupying memory. Only if it
+    can't be cached is the data returned in memory.
+
+    The cache is an optimisation, so failing to read from or write to it is
+    logged rather than raised. Failing to read the file at `path` is raised.
+
+    :param path: The path to the data.
+    :param loader: The function used to load the data on a cache miss, e.g.
+        `datamerger.io.profilometer.load`. It can be partially applied with
+        `functools.partial`. Keyword arguments that are callbacks (e.g. to
+        report progress) don't affect the data, so aren't part of the key, but
+        other keyword arguments are.
+    :param cache_path: The directory in which the cache is stored.
+    :param cache_size: The maximum size of the cache in bytes.
+    :param hash_contents: Whether to include a hash of the file's contents in
+        the cache key.
+    :return: The data contained within the file at `path`.
+    """
+    # If the file can't be read the loader would fail too, so errors making the
+    # key are raised.
+    key = _make_key(path, loader, hash_contents)
+
+    try:
+        sized_data = _read(cache_path, key)
+        if sized_data is not None:
+            return sized_data
+    except:
+        logger.exception(f"Failed to read {path} from the cache")
+
+    sized_data = loader(path)
+
+    try:
+        _write(cache_path, key, sized_data)
+        _evict(cache_path, cache_size)
+
+        # Use the memory-mapped copy so the loaded data can be freed. The entry
+        # may have been evicted if it's larger than the cache.
+        sized_data = _read(cache_path, key) or sized_data
+    except:
+        logger.exception(f"Failed to write {path} to the cache")
+
+    return sized_data
+
+
+def _make_key(
+    path: str, loader: Callable[[str], SizedData], hash_contents: bool
+) -> str:
+    stat = os.stat(path)
+
+    # The loader is part of the key so the same file loaded in different ways
+    # (e.g. as Brillouin and profilometer data) uses different entries.
+    key_hash = hashlib.sha256(f"{_FORMAT_VERSION}\0".encode())
+    while isinstance(loader, functools.partial):
+        for name, value in sorted(loader.keywords.items()):
+            if not callable(value):
+                key_hash.update(f"{name}={value!r}\0".encode())
+        loader = loader.func
+    key_hash.update(f"{loader.__module__}.{loader.__qualname__}".encode())
+    key_hash.update(f"{stat.st_size}\0{stat.st_mtime_ns}".encode())
+
+    # If the contents are hashed the path isn't needed, so copies of a file
+    # share an entry. Otherwise it distinguishes files of the same size that
+    # happen to have the same modification time.
+    if hash_contents:
+        with open(path, "rb") as f:
+            while chunk := f.read(1 << 20):
+                key_hash.update(chunk)
+    else:
+        key_hash.update(os.path.abspath(path).encode())
+
+    return key_hash.hexdigest()
+
+
+def _read(cache_path: str, key: str) -> SizedData | None:
+    data_path = os.path.join(cache_path, f"{key}.npy")
+    metadata_path = os.path.join(cache_path, f"{key}.json")
+
+    # The metadata file is written last, so its presence marks a whole entry.
+    if not os.path.exists(metadata_path):
+        return None
+
+    with open(metadata_path) as f:
+        metadata = json.load(f)
+    data = np.load(data_path, mmap_mode="r")
+
+    # Record that the entry was used for the purposes of eviction.
+    os.utime(metadata_path)
+
+    return SizedData(data, metadata["element_size"], metadata["reduction"])
+
+
+def _write(cache_path: str, key: str, sized_data: SizedData) -> None:
+    os.makedirs(cache_path, exist_ok=True)
+
+    # Write each file to a temporary path then rename it so concurrent readers
+    # never see a partially written entry.
+    def write_atomically(name: str, write: Callable[[int], None]) -> None:
+        fd, temporary_path = tempfile.mkstemp(dir=cache_path, suffix=".tmp")
+        try:
+            write(fd)
+            os.replace(temporary_path, os.path.join(cache_path, name))
+        except:
+            os.remove(temporary_path)
+            raise
+
+    def write_data(fd: int) -> None:
+        with open(fd, "wb") as f:
+            np.save(f, sized_data.data)
+
+    def write_metadata(fd: int) -> None:
+        with open(fd, "w") as f:
+            json.dump(
+                {
+                    "element_size": sized_data.element_size,
+                    "reduction": sized_data.reduction,
+                },
+                f,
+            )
+
+    write_atomically(f"{key}.npy", write_data)
+    write_atomically(f"{key}.json", write_metadata)
+
+
+def _evict(cache_path: str, cache_size: int) -> None:
+    # Gather entries along with their size and the time they were last used.
+    entries: list[tuple[float, int, str]] = []
+    for name in os.listdir(cache_path):
+        key, extension = os.path.splitext(name)
+        if extension != ".json":
+            continue
+
+        metadata_path = os.path.join(cache_path, name)
+        data_path = os.path.join(cache_path, f"{key}.npy")
+        try:
+            metadata_stat = os.stat(metadata_path)
+            size = metadata_stat.st_size + os.stat(data_path).st_size
+        except FileNotFoundError:
+            continue
+
+        entries.append((metadata_stat.st_mtime, size, key))
+
+    # Remove the least recently used entries until the cache fits. The metadata
+    # file is removed first so the entry is never seen without its data.
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, key in sorted(entries):
+        if total_size <= cache_size:
+            break
+
+        for extension in [".json", ".npy"]:
+            try:
+                os.remove(os.path.join(cache_path, f"{key}{extension}"))
+            except OSError:
+                # The file may have been removed by another process, or be
+                # memory-mapped on a platform that doesn't allow that.
+                pass
+
+        total_size -= size
@@ -0,0 +1,3 @@
+class Cancelled(Exception):
+    """Raised by a loader (e.g. `datamerger.io.profilometer.load`) when loading is
+    cancelled via its `is_cancelled` argument."""
@@ -0,0 +1,125 @@
+import os
+import tempfile
+import time
+import zipfile
+from importlib.metadata import version
+from typing import IO, Callable
+
+import numpy as np
+from pewlib import Laser
+from pewlib.config import Config, SpotConfig
+from pewlib.io.npz import pack_calibration, pack_info, unpack_info
+from pewlib.srr.config import SRRConfig
+
+
+def load_pixel_width(path: str) -> float:
+    """Loads the pixel width of elemental data from a pew² .npz file.
+
+    Only the file's header and config are read, so this is much quicker than
+    loading the data with `pewlib.io.npz.load`.
+
+    :param path: The path to the .npz file.
+    :return: The pixel width in µm.
+    """
+    with np.load(path) as npz:
+        # Files from before pewlib 0.8.0 don't have a header.
+        if "header" in npz.files:
+            laser_class = unpack_info(npz["header"])["class"]
+        else:
+            laser_class = str(npz["_class"])
+
+        config_class: type[Config] = Config
+        if laser_class == "Spot":
+            config_class = SpotConfig
+        elif laser_class in ["SRRLaser", "SRR"]:
+            config_class = SRRConfig
+        return config_class.from_array(npz["config"]).get_pixel_width()
+
+
+def save(
+    path: str,
+    laser: Laser,
+    compressed: bool = True,
+    on_progress: Callable[[float], None] | None = None,
+) -> None:
+    """Saves elemental data to a pew² .npz file.
+
+    The file has the same contents as one saved by `pewlib.io.npz.save`, but
+    it's written to a temporary file in the same directory which then replaces
+    the file at `path`, so an existing file (e.g. the original elemental data)
+    is never left partially overwritten. Compression can also be disabled,
+    which is much faster for large data at the cost of a larger file.
+
+    :param path: The path to save to. ".npz" is appended if it's missing.
+    :param laser: The elemental data.
+    :param compressed: Whether to compress the arrays.
+    :param on_progress: Called with the fraction of the data that has been
+        written, from 0 to 1, as the file is written.
+    """
+    if not path.endswith(".npz"):
+        path += ".npz"
+
+    arrays = {
+        "header": pack_info(
+            {
+                "version": version("pewlib"),
+                "class": str(laser.config._class),
+                "time": str(time.time()),
+            }
+        ),
+        "data": laser.data,
+        "calibration": pack_calibration(laser.calibration),
+        "info": pack_info(laser.info),
+        "config": laser.config.to_array(),
+    }
+    total_size = sum(array.nbytes for array in arrays.values())
+    written_size = 0
+
+    class ProgressWriter:
+        """Forwards writes to a file, reporting progress as it goes."""
+
+        def __init__(self, f: IO[bytes]) -> None:
+            self.__f = f
+
+        def write(self, data: bytes) -> None:
+            nonlocal written_size
+            self.__f.write(data)
+            written_size += len(data)
+            if on_progress is not None:
+                on_progress(min(1, written_size / max(1, total_size)))
+
+    fd, temporary_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp"
+    )
+    try:
+        with (
+            open(fd, "wb") as f,
+            zipfile.ZipFile(
+                f,
+                "w",
+                zipfile.ZIP_DEFLATED if compressed else zipfile.ZIP_STORED,
+                allowZip64=True,
+            ) as zip_file,
+        ):
+            for name, array in arrays.items():
+                # NumPy writes large arrays in chunks to objects that aren't
+                # real files, so progress is reported as each chunk is written.
+                with zip_file.open(f"{name}.npy", "w", force_zip64=True) as member:
+                    np.lib.format.write_array(
+                        ProgressWriter(member), array, allow_pickle=False
+                    )
+
+            zip_file.close()
+            f.flush()
+            os.fsync(f.fileno())
+
+        # mkstemp creates files that only the owner can read, so give the file
+        # the permissions it would've had if it had been created normally.
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temporary_path, 0o666 & ~umask)
+
+        os.replace(temporary_path, path)
+    except:
+        os.remove(temporary_path)
+        raise
@@ -1,17 +1,85 @@
+from typing import Callable, Iterator
+
 import numpy as np
 
+from datamerger.resampling import block_mean
+from .cancelled import Cancelled
 from .sized_data import SizedData
 
+# The number of rows to read from the file and convert to floats at a time.
+# Larger blocks mean fewer calls into NumPy, but a higher peak memory usage while
+# each block is converted.
+_BLOCK_ROWS = 256
+
+# The value the profilometer uses to represent an invalid measurement (the most
+# negative 32-bit float).
+_INVALID_VALUE = float("-3.4028235E+38")
+
 
-def load(path: str) -> SizedData:
+def load(
+    path: str,
+    on_progress: Callable[[float], None] | None = None,
+    is_cancelled: Callable[[], bool] | None = None,
+    maximum_element_size: float | None = None,
+    largest_element_size: float | None = None,
+) -> SizedData:
     """Loads profilometer data.
 
     Sometimes values in a profilometer data file are equal to the most negative
     32-bit float. They're not valid measurements and are thus replaced with NaN.
 
     :param path: The path to the profilometer data.
+    :param on_progress: Called with the fraction of the data that has been
+        loaded, from 0 to 1, as the file is read.
+    :param is_cancelled: Called before each block of rows is read. If it returns
+        True, `Cancelled` is raised rather than reading the rest of the file.
+    :param maximum_element_size: The element size in µm to reduce the data's
+        resolution towards as it's loaded, or None to load it at full
+        resolution (see `load_incrementally`).
+    :param largest_element_size: The largest element size in µm the data may be
+        given when it's aligned (see `load_incrementally`).
     :return: The profilometer data contained within the file at `path`.
     """
+    for sized_data, fraction in load_incrementally(
+        path, maximum_element_size, largest_element_size
+    ):
+        if on_progress is not None:
+            on_progress(fraction)
+        if is_cancelled is not None and is_cancelled():
+            raise Cancelled()
+
+    return sized_data
+
+
+def load_incrementally(
+    path: str,
+    maximum_element_size: float | None = None,
+    largest_element_size: float | None = None,
+) -> Iterator[tuple[SizedData, float]]:
+    """Loads profilometer data a block of rows at a time (see `load`).
+
+    The data is allocated up front using the dimensions in the file's header,
+    then each block of rows is read into it in turn. The data and the fraction
+    of its rows that have been read are yielded once the data is allocated and
+    after each block, so callers can report progress or stop iterating to stop
+    reading. The data is complete once the last block has been yielded.
+
+    If the data is much finer than needed, its resolution can be reduced by
+    averaging square blocks of elements as each block of rows is read (see
+    `datamerger.resampling.block_mean`), so the full resolution data is never
+    held in memory. The reduction is recorded in `SizedData.reduction`.
+
+    :param path: The path to the profilometer data.
+    :param maximum_element_size: If given, the data's resolution is reduced by
+        the largest whole factor that doesn't make its elements larger than
+        this many µm.
+    :param largest_element_size: The largest element size in µm the data may be
+        given when it's aligned (e.g. chosen by the user), if it's larger than
+        the size recorded in the file. The reduction scales the elements of the
+        data as given that size too, so it's chosen such that they still aren't
+        larger than `maximum_element_size`.
+    :return: An iterator of the partially loaded data and the fraction loaded.
+    """
     with open(path) as f:
         # Ensure the pixelSize column is present and has units of µm.
         assert f.readline() == "numCols\tnumRows\tpixelSize (um)\n"
@@ -22,24 +90,36 @@ def load(path: str) -> SizedData:
         height = int(properties[1])
         pixel_size = float(properties[2])
 
-        # Allocate an array large enough to store it.
-        data = np.empty((height, width), np.float64)
+        reduction = 1
+        if maximum_element_size is not None:
+            element_size = max(pixel_size, largest_element_size or 0)
+            reduction = max(1, int(maximum_element_size / element_size))
+
+        # Allocate an array large enough to store it. Each block of rows must
+        # be a whole number of reduced rows.
+        data = np.empty((-(-height // reduction), -(-width // reduction)), np.float64)
+        block_rows = max(1, _BLOCK_ROWS // reduction) * reduction
+        sized_data = SizedData(data, pixel_size, reduction)
+        yield sized_data, 0
 
         # Ignore the next line.
         f.readline()
 
-        # Load the data.
+        # Load the data a block of rows at a time. NumPy's parser is much
+        # faster than converting values one by one in Python.
         i = 0
-        while True:
-            line = f.readline().strip()
-            if line == "":
-                break
+        while i < height:
+            rows = min(block_rows, height - i)
+            block = np.loadtxt(f, np.float64, delimiter="\t", max_rows=rows, ndmin=2)
+            assert block.shape == (rows, width), "Unexpected profilometer data shape"
 
-            j = 0
-            for s in line.split("\t"):
-                data[i, j] = float("nan" if s == "-3.4028235E+38" else s)
-                j += 1
+            # Replace invalid measurements with NaN, so they're ignored when
+            # reducing the resolution.
+            block[block == _INVALID_VALUE] = np.nan
 
-            i += 1
+            reduced_block = block_mean(block, reduction)
+            reduced_i = i // reduction
+            data[reduced_i : reduced_i + reduced_block.shape[0]] = reduced_block
+            i += rows
 
-        return SizedData(data, pixel_size)
+            yield sized_data, i / height
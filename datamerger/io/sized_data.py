@@ -10,8 +10,16 @@ class SizedData:
     Each element is assumed to be square, so only one size need be recorded.
     """
 
-    # The array of data.
+    # The array of data. It may be read-only and memory-mapped (see
+    # `datamerger.io.cache`), so it mustn't be modified.
     data: np.ndarray
 
-    # The size of each element in µm.
+    # The size of each element of the original data in µm.
     element_size: float
+
+    # The number of elements of the original data along each axis that were
+    # averaged to make each element of `data`, if its resolution was reduced
+    # as it was loaded. Each element of `data` is `element_size * reduction` µm
+    # wide, so element sizes (e.g. those chosen by the user) always refer to
+    # the original data.
+    reduction: int = 1
@@ -0,0 +1,72 @@
+"""An in-memory cache with a size budget."""
+
+import threading
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """Maps keys to values, evicting the least recently used values when their
+    total size exceeds a budget.
+
+    It's safe to use from multiple threads.
+    """
+
+    def __init__(self, capacity: int, get_size: Callable[[V], int]) -> None:
+        """Initialise the instance.
+
+        :param capacity: The maximum total size of the values.
+        :param get_size: Returns the size of a value, in the same units as
+            `capacity`, e.g. `lambda array: array.nbytes`.
+        """
+        self.__capacity = capacity
+        self.__entries: OrderedDict[K, tuple[V, int]] = OrderedDict()
+        self.__get_size = get_size
+        self.__lock = threading.Lock()
+        self.__size = 0
+
+    def clear(self) -> None:
+        """Removes all values."""
+        with self.__lock:
+            self.__entries.clear()
+            self.__size = 0
+
+    def get(self, key: K) -> V | None:
+        """Returns the value for `key`, or None if there isn't one.
+
+        A value that's returned becomes the most recently used.
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                return None
+
+            self.__entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: K, value: V) -> None:
+        """Adds a value, replacing any existing value for `key`.
+
+        Values larger than the capacity aren't added, as doing so would evict
+        everything else.
+        """
+        size = self.__get_size(value)
+
+        with self.__lock:
+            existing_entry = self.__entries.pop(key, None)
+            if existing_entry is not None:
+                self.__size -= existing_entry[1]
+
+            if size > self.__capacity:
+                return
+
+            self.__entries[key] = (value, size)
+            self.__size += size
+
+            # Evict the least recently used values until we're within budget.
+            while self.__size > self.__capacity:
+                _, (_, evicted_size) = self.__entries.popitem(last=False)
+                self.__size -= evicted_size
@@ -0,0 +1,455 @@
+"""Functions that merge other data into elemental data.
+
+These are shared by the wizard and the command line interface.
+"""
+
+import functools
+from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
+import numpy.typing as npt
+from pewlib import Laser
+from pewlib.io.npz import load as load_npz
+import scipy as sp
+
+from datamerger import config, instrumentation
+from datamerger.io import cache
+from datamerger.io.brillouin import load as load_brillouin
+from datamerger.io.npz import save as save_npz
+from datamerger.io.profilometer import load as load_profilometer
+from datamerger.io.sized_data import SizedData
+from datamerger.resampling import block_mean
+
+# The number of elements to keep either side of the region of the other data
+# that's being aligned. The influence of an element on the cubic spline's
+# coefficients decays by a factor of ~3.7 per element.
+_SOURCE_WINDOW_MARGIN = 16
+
+# The number of rows of resampled data to restore NaNs to at a time (see
+# `_restore_nans`).
+_MASK_CHUNK_ROWS = 256
+
+# The number of times `_fill_nans` fills NaNs from their neighbours before
+# distance transforming the region around the NaNs that remain.
+_NEIGHBOUR_FILL_PASSES = 2
+
+# The number of elements scipy.ndimage pads data with when computing a cubic
+# spline's coefficients with mode="nearest", so the coefficients near the edges
+# are accurate.
+_SPLINE_PADDING = 12
+
+
+# The element sizes in µm the user can choose between when aligning other data,
+# along with the size recorded in the data.
+ELEMENT_SIZES = [5, 10, 20, 50]
+
+
+@dataclass
+class Alignment:
+    """How other data is aligned with elemental data."""
+
+    # The size of each element of the other data in µm, or None to use the
+    # element size recorded in the data. Like `SizedData.element_size`, this is
+    # the size of the original data's elements even if its resolution has been
+    # reduced.
+    element_size: float | None
+
+    # The position of the top-left corner of the manipulated data relative to
+    # the top-left corner of the elemental data, in elemental data pixels (x, y).
+    # This may be a fraction of a pixel.
+    position: tuple[float, float]
+
+    # The amount the other data is rotated. Each unit corresponds to a
+    # counter-clockwise rotation of 90 degrees.
+    rotation: int
+
+
+def get_maximum_element_size(
+    pixel_width: float, resolution: float = config.LOAD_RESOLUTION
+) -> float | None:
+    """Returns the element size to reduce the resolution of other data towards as
+    it's loaded, e.g. the `maximum_element_size` of
+    `datamerger.io.profilometer.load`.
+
+    :param pixel_width: The pixel width in µm of the elemental data the other
+        data will be merged into, e.g. from `datamerger.io.npz.load_pixel_width`.
+    :param resolution: The minimum number of elements of other data to keep per
+        elemental data pixel width, or 0 to not reduce the resolution.
+    :return: The maximum element size in µm, or None.
+    """
+    if resolution <= 0:
+        return None
+    return pixel_width / resolution
+
+
+def manipulate_data(
+    sized_data: SizedData,
+    element_size: float,
+    rotation: int,
+    pixel_width: float,
+    dtype: npt.DTypeLike = np.float64,
+) -> np.ndarray:
+    """Rotates and resamples data so it has the same resolution as elemental
+    data.
+
+    :param sized_data: The data to manipulate.
+    :param element_size: The element size to use instead of
+        sized_data.element_size.
+    :param rotation: The amount to rotate the data. Each unit corresponds to a
+        counter-clockwise rotation of 90 degrees, e.g. 1 is 90, -1 is -90.
+    :param pixel_width: The width of each pixel of the elemental data in µm.
+    :param dtype: The dtype in which to manipulate and return the data. float32
+        uses half the memory of float64.
+    :return: The manipulated data. Elements whose nearest element of the data
+        (averaged in blocks if it's being reduced, see `_get_block_factor`) is
+        NaN are NaN.
+    """
+    # Rotate in increments of 90 degrees. This doesn't copy the data.
+    data = np.rot90(sized_data.data, k=rotation)
+    zoom = element_size * sized_data.reduction / pixel_width
+    output_shape = _get_manipulated_shape(data.shape, zoom)
+
+    # Average blocks of the data first if it's being reduced significantly.
+    factor = _get_block_factor(zoom)
+    data = block_mean(data, factor)
+    zoom *= factor
+
+    # Copy the data into the middle of a padded array and fill in NaNs,
+    # otherwise they spread everywhere when we zoom. Then pad it by repeating
+    # its edges as scipy.ndimage does for mode="nearest". NaNs are filled first
+    # so they're filled as align_data fills them.
+    padding = _SPLINE_PADDING
+    padded_data = np.empty(
+        (data.shape[0] + 2 * padding, data.shape[1] + 2 * padding), dtype
+    )
+    padded_data[padding:-padding, padding:-padding] = data
+    invalid = _fill_nans(padded_data[padding:-padding, padding:-padding])
+    _repeat_edges(padded_data, padding)
+    data = padded_data
+
+    # Compute the cubic spline's coefficients in place, as otherwise
+    # scipy.ndimage would compute them in another, float64, copy of the data.
+    sp.ndimage.spline_filter(data, output=data, mode="nearest")
+
+    # Resample the image so it has the same resolution as the laser data. Each
+    # element is treated as a square of data (as with scipy.ndimage.zoom's
+    # grid mode) so the result lines up with align_data.
+    offset = 0.5 / zoom - 0.5
+    manipulated_data = sp.ndimage.affine_transform(
+        data,
+        [1 / zoom, 1 / zoom],
+        offset=offset + padding,
+        output_shape=output_shape,
+        mode="nearest",
+        prefilter=False,
+    )
+    _restore_nans(manipulated_data, invalid, zoom, offset)
+
+    return manipulated_data
+
+
+def align_data(laser: Laser, sized_data: SizedData, alignment: Alignment) -> np.ndarray:
+    """Rotates, resamples, and positions data so it's aligned with elemental
+    data.
+
+    The result is equivalent to placing the output of `manipulate_data` at
+    `alignment.position` and cropping it to the elemental data, but the shift
+    and zoom are performed in a single resampling pass, so the position may be a
+    fraction of a pixel. Only the part of the other data that overlaps the
+    elemental data is copied and resampled, so the memory used is bounded by the
+    size of the elemental data rather than the resampled other data.
+
+    :param laser: The elemental data.
+    :param sized_data: The data to align.
+    :param alignment: How to align the data.
+    :return: An array with the same shape as the elemental data. Elements not
+        covered by the other data, or whose nearest element of it (averaged in
+        blocks as by `manipulate_data`) is NaN, are NaN.
+    """
+    # Determine the dtype. This assumes all elements use the same dtype.
+    dtype = laser.get(laser.elements[0]).dtype
+    aligned_data = np.full(laser.data.shape, np.nan, dtype)
+
+    # Rotate in increments of 90 degrees. This doesn't copy the data.
+    data = np.rot90(sized_data.data, k=alignment.rotation)
+
+    # Determine which elements of the elemental data have their centre covered
+    # by the rotated and resampled data, which has the same shape as
+    # manipulate_data's output.
+    element_size = alignment.element_size or sized_data.element_size
+    zoom = element_size * sized_data.reduction / laser.config.get_pixel_width()
+    manipulated_height, manipulated_width = _get_manipulated_shape(data.shape, zoom)
+    x, y = alignment.position
+    height, width = laser.data.shape
+    y0 = max(0, int(np.ceil(y - 0.5)))
+    y1 = min(height, int(np.ceil(y + manipulated_height - 0.5)))
+    x0 = max(0, int(np.ceil(x - 0.5)))
+    x1 = min(width, int(np.ceil(x + manipulated_width - 0.5)))
+    if y0 >= y1 or x0 >= x1:
+        return aligned_data
+
+    # Average blocks of the data first if it's being reduced significantly, as
+    # manipulate_data does. The blocks line up with manipulate_data's, so rows
+    # and columns below are in blocks.
+    factor = _get_block_factor(zoom)
+    zoom *= factor
+
+    # Only the part of the data that maps onto those elements is needed, so
+    # crop it before copying (or averaging) it to fill in NaNs (see
+    # manipulate_data).
+    rows = _get_source_window(y0 - y, y1 - y, zoom, -(-data.shape[0] // factor))
+    columns = _get_source_window(x0 - x, x1 - x, zoom, -(-data.shape[1] // factor))
+    window = data[
+        rows.start * factor : rows.stop * factor,
+        columns.start * factor : columns.stop * factor,
+    ]
+    data = block_mean(window, factor) if factor > 1 else np.array(window)
+    invalid = _fill_nans(data)
+
+    # Map the centre of each of those elements to a position in the cropped
+    # data and interpolate.
+    offset = (
+        (y0 - y + 0.5) / zoom - 0.5 - rows.start,
+        (x0 - x + 0.5) / zoom - 0.5 - columns.start,
+    )
+    aligned_data[y0:y1, x0:x1] = sp.ndimage.affine_transform(
+        data,
+        [1 / zoom, 1 / zoom],
+        offset=offset,
+        output_shape=(y1 - y0, x1 - x0),
+        mode="nearest",
+    )
+    _restore_nans(aligned_data[y0:y1, x0:x1], invalid, zoom, offset)
+
+    return aligned_data
+
+
+def add_aligned_data(laser: Laser, element: str, aligned_data: np.ndarray) -> None:
+    """Adds aligned data to elemental data, replacing any existing element with
+    the same name.
+
+    :param laser: The elemental data.
+    :param element: The name of the element, e.g. "Brillouin".
+    :param aligned_data: Data returned by `align_data`.
+    """
+    if element in laser.elements:
+        laser.remove(element)
+    laser.add(element, aligned_data)
+
+
+def _repeat_edges(padded: np.ndarray, padding: int) -> None:
+    """Pads data in place by repeating the edges of the data in its middle, like
+    `np.pad(..., padding, mode="edge")` but without allocating another array.
+    """
+    # Repeat the first and last rows, then the first and last columns, which
+    # fills in the corners too.
+    padded[:padding, padding:-padding] = padded[padding, padding:-padding]
+    padded[-padding:, padding:-padding] = padded[-padding - 1, padding:-padding]
+    padded[:, :padding] = padded[:, padding : padding + 1]
+    padded[:, -padding:] = padded[:, -padding - 1 : -padding]
+
+
+def _fill_nans(data: np.ndarray) -> np.ndarray | None:
+    """Replaces each NaN in data, in place, with (approximately) the nearest
+    element that isn't NaN.
+
+    Interpolating NaNs would spread them, and replacing them with any fixed
+    value would bleed into the neighbouring elements, so they're replaced with
+    their nearest value (which leaves flat regions flat) and restored afterwards
+    by `_restore_nans`.
+
+    Most NaNs are isolated, so they're filled from a neighbouring element by
+    looking at the neighbours of each NaN, which is much cheaper than a distance
+    transform of the whole array. Only the region around any larger holes that
+    remain is distance transformed.
+
+    :return: A boolean array marking where the NaNs were, or None if there
+        weren't any.
+    """
+    invalid = np.isnan(data)
+    if not invalid.any():
+        return None
+    if invalid.all():
+        data.fill(0)
+        return invalid
+
+    height, width = data.shape
+    rows, columns = np.nonzero(invalid)
+    for _ in range(_NEIGHBOUR_FILL_PASSES):
+        for row_step, column_step in [(0, -1), (0, 1), (-1, 0), (1, 0)]:
+            neighbours = data[
+                np.clip(rows + row_step, 0, height - 1),
+                np.clip(columns + column_step, 0, width - 1),
+            ]
+            found = ~np.isnan(neighbours)
+            data[rows[found], columns[found]] = neighbours[found]
+            rows = rows[~found]
+            columns = columns[~found]
+
+    if len(rows) > 0:
+        # Include the elements surrounding the holes, which aren't NaN.
+        region = data[
+            max(0, rows.min() - 1) : rows.max() + 2,
+            max(0, columns.min() - 1) : columns.max() + 2,
+        ]
+        region_invalid = np.isnan(region)
+        indices = sp.ndimage.distance_transform_edt(
+            region_invalid, return_distances=False, return_indices=True
+        )
+        region[region_invalid] = region[
+            indices[0][region_invalid], indices[1][region_invalid]
+        ]
+
+    return invalid
+
+
+def _restore_nans(
+    resampled_data: np.ndarray,
+    invalid: np.ndarray | None,
+    zoom: float,
+    offset: float | tuple[float, float],
+) -> None:
+    """Sets the elements of resampled data whose nearest element of the data is
+    NaN to NaN, in place.
+
+    The data is only scaled, so the nearest element of each row and column can
+    be found separately, which is much cheaper than resampling the mask of
+    NaNs with `sp.ndimage.affine_transform`.
+
+    :param resampled_data: The data resampled by `sp.ndimage.affine_transform`.
+    :param invalid: The NaNs of the data, as returned by `_fill_nans`.
+    :param zoom: The zoom the data was resampled with.
+    :param offset: The offset the data was resampled with.
+    """
+    if invalid is None:
+        return
+
+    rows, columns = [
+        np.clip(
+            np.rint(np.arange(output_size) / zoom + axis_offset).astype(np.intp),
+            0,
+            size - 1,
+        )
+        for output_size, axis_offset, size in zip(
+            resampled_data.shape, np.broadcast_to(offset, 2), invalid.shape
+        )
+    ]
+
+    # Mask a few rows of the output at a time, so a mask the size of the output
+    # is never allocated, skipping rows of the data without NaNs.
+    invalid_rows = np.logical_or.reduce(invalid, axis=1)
+    for i in range(0, len(rows), _MASK_CHUNK_ROWS):
+        chunk_rows = rows[i : i + _MASK_CHUNK_ROWS]
+        if invalid_rows[chunk_rows].any():
+            np.copyto(
+                resampled_data[i : i + _MASK_CHUNK_ROWS],
+                np.nan,
+                where=invalid[chunk_rows][:, columns],
+            )
+
+
+def _get_manipulated_shape(shape: tuple[int, ...], zoom: float) -> tuple[int, int]:
+    """Returns the shape of (rotated) data of a shape once it's resampled by
+    `zoom`.
+
+    Both `manipulate_data` and `align_data` use this, so the data the user aligns
+    covers exactly the elements of the elemental data it's merged into.
+    """
+    return round(shape[0] * zoom), round(shape[1] * zoom)
+
+
+def _get_block_factor(zoom: float) -> int:
+    """Returns the factor to reduce the resolution of data by with `block_mean`
+    before resampling it by `zoom`.
+
+    When the data is reduced by a factor of 2 or more, interpolation would
+    ignore most of its elements, so the result would be aliased and resampling
+    would copy far more data than it uses. Averaging blocks of elements first
+    avoids both, as `datamerger.registration` does.
+    """
+    return max(1, int(np.floor(1 / zoom)))
+
+
+def _get_source_window(start: float, stop: float, zoom: float, size: int) -> slice:
+    """Returns the range of elements of the data, along one axis, needed to
+    interpolate the elements of the output from `start` to `stop` (relative to
+    the data's position, exclusive).
+
+    The range is padded by `_SOURCE_WINDOW_MARGIN` so cropping doesn't noticeably
+    change the cubic spline's coefficients, which depend on nearby elements.
+    """
+    first = int(np.floor((start + 0.5) / zoom - 0.5)) - _SOURCE_WINDOW_MARGIN
+    last = int(np.ceil((stop - 0.5) / zoom - 0.5)) + _SOURCE_WINDOW_MARGIN
+    return slice(max(0, first), min(size, last + 1))
+
+
+def merge_files(
+    elemental_data_path: str,
+    output_path: str,
+    brillouin_data_path: str = "",
+    brillouin_alignment: Alignment | None = None,
+    profilometer_data_path: str = "",
+    profilometer_alignment: Alignment | None = None,
+    compressed: bool = True,
+) -> None:
+    """Merges Brillouin and/or profilometer data into elemental data and saves
+    the result.
+
+    This does the same thing as the wizard, but with the alignment specified up
+    front rather than chosen interactively.
+
+    :param elemental_data_path: The path to the pew² .npz file.
+    :param output_path: The path to save the merged pew² .npz file to.
+    :param brillouin_data_path: The path to the Brillouin data, or "" for none.
+    :param brillouin_alignment: How to align the Brillouin data. Required if
+        `brillouin_data_path` is given.
+    :param profilometer_data_path: The path to the profilometer data, or "" for
+        none.
+    :param profilometer_alignment: How to align the profilometer data. Required
+        if `profilometer_data_path` is given.
+    :param compressed: Whether to compress the output file.
+    """
+    assert (
+        brillouin_data_path != "" or profilometer_data_path != ""
+    ), "At least one of Brillouin or profilometer data is required"
+
+    with instrumentation.measure("Load elemental data", path=elemental_data_path):
+        laser = load_npz(elemental_data_path)
+
+    # Profilometer data can be much finer than the elemental data, so reduce
+    # its resolution as it's loaded. The alignment's element size (if it gives
+    # one) scales the reduced elements too, so it limits the reduction.
+    loaders: list[tuple[str, str, Callable[[str], SizedData], Alignment | None]] = [
+        ("Brillouin", brillouin_data_path, load_brillouin, brillouin_alignment),
+        (
+            "Profilometer",
+            profilometer_data_path,
+            functools.partial(
+                load_profilometer,
+                maximum_element_size=get_maximum_element_size(
+                    laser.config.get_pixel_width()
+                ),
+                largest_element_size=(
+                    None
+                    if profilometer_alignment is None
+                    else profilometer_alignment.element_size
+                ),
+            ),
+            profilometer_alignment,
+        ),
+    ]
+    for element, path, loader, alignment in loaders:
+        if path == "":
+            continue
+
+        assert alignment is not None, f"{element} alignment is missing"
+        with instrumentation.measure(f"Load {element} data", path=path):
+            sized_data = cache.load(path, loader)
+        with instrumentation.measure(f"Align {element} data"):
+            add_aligned_data(laser, element, align_data(laser, sized_data, alignment))
+
+    with instrumentation.measure(
+        "Save merged data", compressed=compressed, path=output_path
+    ):
+        save_npz(output_path, laser, compressed)
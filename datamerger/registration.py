@@ -0,0 +1,402 @@
+"""Functions that automatically align (register) other data with elemental data."""
+
+from dataclasses import dataclass
+
+import numpy as np
+import scipy as sp
+
+from datamerger.io.sized_data import SizedData
+from datamerger.resampling import block_mean, resample
+
+# The maximum width or height of the images at the coarsest level of the
+# pyramid, where every candidate is correlated at every offset.
+COARSE_SIZE = 128
+
+# The minimum width or height of the other data at the coarsest level of the
+# pyramid, where possible. Small images can correlate strongly by chance.
+MINIMUM_SIZE = 16
+
+# The number of candidates from the coarsest level that are refined.
+CANDIDATES = 3
+
+# The maximum width or height of the patch of elemental data used to refine a
+# candidate's position at each level of the pyramid.
+PATCH_SIZE = 256
+
+# The minimum number of overlapping pixels for an offset to be considered, as a
+# fraction of the number of valid pixels in the smaller of the two images and as
+# an absolute number. Small overlaps can correlate strongly by chance.
+MINIMUM_OVERLAP = 0.25
+MINIMUM_OVERLAP_PIXELS = 64
+
+# The distance in pixels a candidate's position is searched at each level of the
+# pyramid, relative to its position at the previous (coarser) level.
+SEARCH_RADIUS = 2
+
+
+@dataclass
+class Registration:
+    """The result of registering other data with elemental data."""
+
+    # The size of each element of the other data in µm.
+    element_size: float
+
+    # The position of the top-left corner of the rotated and resampled other
+    # data relative to the top-left corner of the elemental data, in elemental
+    # data pixels (x, y). This may be a fraction of a pixel.
+    position: tuple[float, float]
+
+    # The amount the other data is rotated. Each unit corresponds to a
+    # counter-clockwise rotation of 90 degrees.
+    rotation: int
+
+    # The normalised cross-correlation of the aligned data, from -1 to 1.
+    score: float
+
+
+def register(
+    fixed: np.ndarray,
+    pixel_width: float,
+    sized_data: SizedData,
+    element_sizes: list[float],
+) -> Registration:
+    """Finds the element size, rotation, and position that best align other data
+    with elemental data.
+
+    This searches an image pyramid from coarse to fine. At the coarsest level
+    every combination of element size and rotation (each of the four
+    orientations produced by `np.rot90`) is correlated at every offset. The
+    best few candidates are then refined at each finer level by searching a
+    small window around their previous position using a patch of the data, so
+    the cost of the finer levels doesn't grow with the size of the data.
+    Finally, the position is refined to a fraction of a pixel. NaNs are
+    ignored.
+
+    :param fixed: The image to align with, e.g. an element of the elemental
+        data.
+    :param pixel_width: The width of each pixel of `fixed` in µm.
+    :param sized_data: The data to align.
+    :param element_sizes: The candidate element sizes of `sized_data` in µm.
+    :return: The best registration.
+    """
+    pyramid = _Pyramid(fixed, pixel_width, sized_data)
+
+    # Each candidate is recorded along with the level it was found at.
+    candidates: list[tuple[Registration, int]] = []
+    for element_size in element_sizes:
+        level = pyramid.coarsest_level(element_size)
+        coarse_fixed = pyramid.fixed(level)
+        coarse_moving = pyramid.moving(element_size, level)
+
+        for rotation in range(4):
+            rotated = np.rot90(coarse_moving, k=rotation)
+            correlation = correlate(coarse_fixed, rotated)
+            if np.isnan(correlation).all():
+                continue
+
+            y, x = np.unravel_index(np.nanargmax(correlation), correlation.shape)
+            position = (int(x) - rotated.shape[1] + 1, int(y) - rotated.shape[0] + 1)
+            score = float(correlation[y, x])
+            candidates.append(
+                (Registration(element_size, position, rotation, score), level)
+            )
+
+    assert len(candidates) > 0, "The images don't overlap enough to be registered"
+
+    best: Registration | None = None
+    candidates.sort(key=lambda candidate: candidate[0].score, reverse=True)
+    for candidate, coarsest_level in candidates[:CANDIDATES]:
+        for level in reversed(range(coarsest_level)):
+            candidate = pyramid.refine(candidate, level)
+        candidate = pyramid.refine_subpixel(candidate)
+
+        if best is None or candidate.score > best.score:
+            best = candidate
+
+    assert best is not None
+    return best
+
+
+class _Pyramid:
+    """Lazily creates and caches the images at each level of the pyramid.
+
+    Level n has 2^n times fewer pixels in each dimension than the elemental
+    data.
+    """
+
+    def __init__(
+        self, fixed: np.ndarray, pixel_width: float, sized_data: SizedData
+    ) -> None:
+        self.__fixed = {0: fixed}
+        self.__pixel_width = pixel_width
+        self.__data = {0: sized_data.data}
+
+        # Element sizes refer to the original data, which may have had its
+        # resolution reduced (see SizedData.reduction).
+        self.__load_reduction = sized_data.reduction
+
+    def coarsest_level(self, element_size: float) -> int:
+        """Returns the level at which neither image exceeds `COARSE_SIZE`,
+        unless that would make the other data smaller than `MINIMUM_SIZE`."""
+        moving_shape = np.multiply(
+            self.__data_shape, element_size * self.__load_reduction / self.__pixel_width
+        )
+        level = np.ceil(
+            np.log2(max(*self.__fixed[0].shape, *moving_shape) / COARSE_SIZE)
+        )
+        level = min(level, np.floor(np.log2(min(moving_shape) / MINIMUM_SIZE)))
+        return max(0, int(level))
+
+    def fixed(self, level: int) -> np.ndarray:
+        if level not in self.__fixed:
+            self.__fixed[level] = block_mean(self.fixed(level - 1), 2)
+        return self.__fixed[level]
+
+    def moving(
+        self,
+        element_size: float,
+        level: int,
+        shape: tuple[int, int] | None = None,
+        offset: tuple[int, int] = (0, 0),
+    ) -> np.ndarray:
+        """Returns (a region of) the other data, unrotated, at a level.
+
+        See `resample` for a description of `shape` and `offset`.
+        """
+        zoom = element_size * self.__load_reduction / (self.__pixel_width * 2**level)
+        if shape is None:
+            shape = (
+                round(self.__data_shape[0] * zoom),
+                round(self.__data_shape[1] * zoom),
+            )
+
+        # Average blocks of the data first if it's being reduced significantly,
+        # as bilinear interpolation would ignore most of it.
+        reduction = max(0, int(np.floor(np.log2(1 / zoom))))
+        return resample(
+            self.__reduced_data(reduction), zoom * 2**reduction, shape, offset
+        )
+
+    def refine(self, candidate: Registration, level: int) -> Registration:
+        """Refines a candidate from the next coarsest level at `level`."""
+        x, y = 2 * int(candidate.position[0]), 2 * int(candidate.position[1])
+        scores = self.__search(candidate, (x, y), level, SEARCH_RADIUS)
+        dy, dx = np.unravel_index(np.argmax(scores), scores.shape)
+        return Registration(
+            candidate.element_size,
+            (x + int(dx) - SEARCH_RADIUS, y + int(dy) - SEARCH_RADIUS),
+            candidate.rotation,
+            float(scores[dy, dx]),
+        )
+
+    def refine_subpixel(self, candidate: Registration) -> Registration:
+        """Refines a candidate at level 0 to a fraction of a pixel by fitting a
+        parabola to the scores either side of its position in each axis."""
+        x, y = int(candidate.position[0]), int(candidate.position[1])
+        scores = self.__search(candidate, (x, y), 0, 1)
+
+        def fit(before: float, at: float, after: float) -> float:
+            curvature = before - 2 * at + after
+            if not np.isfinite(curvature) or curvature >= 0:
+                return 0
+            return float(np.clip((before - after) / (2 * curvature), -0.5, 0.5))
+
+        return Registration(
+            candidate.element_size,
+            (x + fit(*scores[1, :]), y + fit(*scores[:, 1])),
+            candidate.rotation,
+            candidate.score,
+        )
+
+    def __search(
+        self,
+        candidate: Registration,
+        position: tuple[int, int],
+        level: int,
+        radius: int,
+    ) -> np.ndarray:
+        """Scores the positions within `radius` pixels of `position` at `level`.
+
+        :return: An array of shape (2 * radius + 1, 2 * radius + 1). The element
+            at (radius + dy, radius + dx) is the score of position
+            (x + dx, y + dy). Positions that can't be scored are -inf.
+        """
+        scores = np.full((2 * radius + 1, 2 * radius + 1), -np.inf)
+        fixed = self.fixed(level)
+        zoom = (
+            candidate.element_size
+            * self.__load_reduction
+            / (self.__pixel_width * 2**level)
+        )
+        height = round(self.__data_shape[0] * zoom)
+        width = round(self.__data_shape[1] * zoom)
+        if candidate.rotation % 2 == 1:
+            height, width = width, height
+
+        # Choose a patch of the elemental data at the centre of the overlap.
+        x, y = position
+        y0, y1 = max(0, y), min(fixed.shape[0], y + height)
+        x0, x1 = max(0, x), min(fixed.shape[1], x + width)
+        patch_height = min(PATCH_SIZE, y1 - y0)
+        patch_width = min(PATCH_SIZE, x1 - x0)
+        if patch_height <= 0 or patch_width <= 0:
+            return scores
+        py = (y0 + y1 - patch_height) // 2
+        px = (x0 + x1 - patch_width) // 2
+        patch = fixed[py : py + patch_height, px : px + patch_width]
+
+        # Resample the region of the other data that overlaps the patch at
+        # every offset in the search window. The region is specified in rotated
+        # coordinates, so it's converted to unrotated coordinates, resampled,
+        # then rotated.
+        region = (
+            py - y - radius,
+            px - x - radius,
+            patch_height + 2 * radius,
+            patch_width + 2 * radius,
+        )
+        moving = np.rot90(
+            self.moving(
+                candidate.element_size,
+                level,
+                *_unrotate_region(region, height, width, candidate.rotation),
+            ),
+            k=candidate.rotation,
+        )
+
+        for dy in range(-radius, radius + 1):
+            for dx in range(-radius, radius + 1):
+                scores[radius + dy, radius + dx] = _correlate_at(
+                    patch,
+                    moving[
+                        radius - dy : radius - dy + patch_height,
+                        radius - dx : radius - dx + patch_width,
+                    ],
+                )
+
+        return scores
+
+    @property
+    def __data_shape(self) -> tuple[int, int]:
+        return self.__data[0].shape  # type: ignore[return-value]
+
+    def __reduced_data(self, reduction: int) -> np.ndarray:
+        """Returns the other data with 2^reduction times fewer elements in each
+        dimension."""
+        if reduction not in self.__data:
+            self.__data[reduction] = block_mean(self.__reduced_data(reduction - 1), 2)
+        return self.__data[reduction]
+
+
+def _correlate_at(fixed: np.ndarray, moving: np.ndarray) -> float:
+    """Calculates the normalised cross-correlation of two images with the same
+    shape, ignoring NaNs."""
+    mask = np.isfinite(fixed) & np.isfinite(moving)
+    if mask.sum() < 2:
+        return -np.inf
+
+    a = fixed[mask] - fixed[mask].mean()
+    b = moving[mask] - moving[mask].mean()
+    denominator = np.sqrt(np.dot(a, a) * np.dot(b, b))
+    return float(np.dot(a, b) / denominator) if denominator > 0 else -np.inf
+
+
+def _unrotate_region(
+    region: tuple[int, int, int, int], height: int, width: int, rotation: int
+) -> tuple[tuple[int, int], tuple[int, int]]:
+    """Converts a region of an image rotated by `np.rot90` to the corresponding
+    region of the unrotated image.
+
+    :param region: The region of the rotated image (y, x, height, width).
+    :param height: The height of the rotated image.
+    :param width: The width of the rotated image.
+    :param rotation: The `k` passed to `np.rot90`.
+    :return: The shape and offset of the region of the unrotated image.
+    """
+    y, x, region_height, region_width = region
+    match rotation % 4:
+        case 0:
+            return (region_height, region_width), (y, x)
+        case 1:
+            # rot90 with k=1 maps unrotated (i, j) to rotated (W - 1 - j, i),
+            # where W is the unrotated width (the rotated height).
+            return (region_width, region_height), (x, height - y - region_height)
+        case 2:
+            return (region_height, region_width), (
+                height - y - region_height,
+                width - x - region_width,
+            )
+        case _:
+            # rot90 with k=3 maps unrotated (i, j) to rotated (j, H - 1 - i),
+            # where H is the unrotated height (the rotated width).
+            return (region_width, region_height), (width - x - region_width, y)
+
+
+def correlate(fixed: np.ndarray, moving: np.ndarray) -> np.ndarray:
+    """Calculates the normalised cross-correlation of two images at every
+    offset, ignoring NaNs.
+
+    This is the masked normalised cross-correlation described by Padfield in
+    "Masked Object Registration in the Fourier Domain", calculated with FFTs.
+
+    :param fixed: An image.
+    :param moving: An image with the same resolution as `fixed`.
+    :return: An array of shape `fixed.shape + moving.shape - 1`. The element at
+        (y, x) is the correlation when the top-left corner of `moving` is at
+        (x - moving.shape[1] + 1, y - moving.shape[0] + 1) relative to the
+        top-left corner of `fixed`. Offsets with too little overlap are NaN.
+    """
+    # Subtracting the means doesn't change the correlation but reduces the
+    # error in the sums of squares below.
+    fixed_mask = np.isfinite(fixed)
+    moving_mask = np.isfinite(moving)
+    fixed = np.where(fixed_mask, fixed - np.nanmean(fixed), 0)
+    moving = np.where(moving_mask, moving - np.nanmean(moving), 0)
+
+    # Correlation is convolution with one of the images flipped. Each image's
+    # transform is reused by several of the sums below.
+    shape = np.add(fixed.shape, moving.shape) - 1
+    fft_shape = [sp.fft.next_fast_len(int(n), real=True) for n in shape]
+
+    def transform(image: np.ndarray) -> np.ndarray:
+        return sp.fft.rfft2(image, fft_shape)
+
+    def correlate_transforms(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        return sp.fft.irfft2(a * b, fft_shape)[: shape[0], : shape[1]]
+
+    f = transform(fixed)
+    ff = transform(fixed * fixed)
+    fm = transform(fixed_mask.astype(np.float64))
+    flipped_moving = moving[::-1, ::-1]
+    m = transform(flipped_moving)
+    mm = transform(flipped_moving * flipped_moving)
+    mm_mask = transform(moving_mask[::-1, ::-1].astype(np.float64))
+
+    # The number of overlapping pixels and the sums over the overlap.
+    overlap = np.round(correlate_transforms(fm, mm_mask))
+    fixed_sum = correlate_transforms(f, mm_mask)
+    moving_sum = correlate_transforms(fm, m)
+    fixed_squared_sum = correlate_transforms(ff, mm_mask)
+    moving_squared_sum = correlate_transforms(fm, mm)
+    product_sum = correlate_transforms(f, m)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        numerator = product_sum - fixed_sum * moving_sum / overlap
+        fixed_variance = fixed_squared_sum - fixed_sum**2 / overlap
+        moving_variance = moving_squared_sum - moving_sum**2 / overlap
+        correlation = numerator / np.sqrt(fixed_variance * moving_variance)
+
+    # Ignore offsets with too little overlap or where either image is
+    # (numerically) constant.
+    minimum_overlap = max(
+        MINIMUM_OVERLAP * min(fixed_mask.sum(), moving_mask.sum()),
+        MINIMUM_OVERLAP_PIXELS,
+    )
+    tolerance = 1e-9 * max(fixed_squared_sum.max(), moving_squared_sum.max())
+    correlation[
+        (overlap < minimum_overlap)
+        | (fixed_variance <= tolerance)
+        | (moving_variance <= tolerance)
+    ] = np.nan
+
+    return correlation
@@ -0,0 +1,74 @@
+"""Functions that change the resolution of two-dimensional data.
+
+NaNs represent missing data.
+"""
+
+import numpy as np
+import scipy as sp
+
+
+def block_mean(data: np.ndarray, factor: int) -> np.ndarray:
+    """Reduces the resolution of data by averaging square blocks of elements.
+
+    NaNs are ignored, so a block is only NaN if all of its elements are NaN. If
+    the dimensions of the data aren't multiples of `factor` the blocks at the
+    bottom and right edges are partial.
+
+    :param data: The data to reduce.
+    :param factor: The width and height of each block.
+    :return: An array of shape `ceil(data.shape / factor)`.
+    """
+    if factor == 1:
+        return data
+
+    height = -(-data.shape[0] // factor)
+    width = -(-data.shape[1] // factor)
+    sums = np.zeros((height, width), np.float64)
+    counts = np.zeros((height, width), np.int64)
+
+    # Accumulate the element at each position within the blocks. Strided views
+    # are faster than reshaping and summing over the non-contiguous axes.
+    for i in range(factor):
+        for j in range(factor):
+            elements = data[i::factor, j::factor]
+            valid = np.isfinite(elements)
+            region = (slice(0, elements.shape[0]), slice(0, elements.shape[1]))
+            sums[region] += np.where(valid, elements, 0)
+            counts[region] += valid
+
+    with np.errstate(invalid="ignore"):
+        return sums / counts
+
+
+def resample(
+    data: np.ndarray,
+    zoom: float,
+    shape: tuple[int, int] | None = None,
+    offset: tuple[int, int] = (0, 0),
+) -> np.ndarray:
+    """Resamples data (or a region of it) with bilinear interpolation.
+
+    Element (i, j) of the output is centred on element
+    ((offset[0] + i + 0.5) / zoom - 0.5, (offset[1] + j + 0.5) / zoom - 0.5) of
+    the input. Elements that depend on NaNs or lie outside the input are NaN.
+
+    Bilinear interpolation ignores most of the input when `zoom` is much less
+    than 1, so consider using `block_mean` first.
+
+    :param data: The data to resample.
+    :param zoom: The number of output elements per input element.
+    :param shape: The shape of the output. Defaults to the shape of the whole
+        resampled data.
+    :param offset: The index of the first element of the output (y, x) in the
+        whole resampled data.
+    :return: The resampled data.
+    """
+    if shape is None:
+        shape = (round(data.shape[0] * zoom), round(data.shape[1] * zoom))
+
+    y = (np.arange(offset[0], offset[0] + shape[0]) + 0.5) / zoom - 0.5
+    x = (np.arange(offset[1], offset[1] + shape[1]) + 0.5) / zoom - 0.5
+    coordinates = np.meshgrid(y, x, indexing="ij")
+    return sp.ndimage.map_coordinates(
+        data, coordinates, cval=np.nan, mode="constant", order=1
+    )
@@ -1,3 +1,4 @@
 from .data_alignment_view import DataAlignmentView
+from .element_image_cache import ElementImageCache
 from .path_select_widget import PathSelectWidget
 from .turbo_color_table import turbo_color_table
@@ -0,0 +1,52 @@
+import warnings
+
+import numpy as np
+
+# The number of elements used to estimate the range of data when mapping it to
+# colours.
+COLOR_MAPPING_SAMPLE_SIZE = 256 * 256
+
+# The number of elements mapped to colours at a time. Small enough that the
+# intermediate values fit in the CPU's cache.
+COLOR_MAPPING_CHUNK_SIZE = 64 * 1024
+
+
+def map_data_to_color_indices(data: np.ndarray) -> np.ndarray:
+    """Maps a two-dimensional array of data to indices into a 256 entry colour
+    table, e.g. `turbo_color_table`.
+
+    The minimum and 99th percentile of the data are mapped to the first and
+    last entries. They're estimated from an evenly spaced sample of at most
+    `COLOR_MAPPING_SAMPLE_SIZE` elements, so values outside them are clipped.
+    NaNs are mapped to the first entry.
+
+    :return: An array of uint8s with the same shape as the data.
+    """
+    assert data.ndim == 2, "Can't make an image from an array that isn't 2D"
+
+    # Determine the minimum and maximum values (ignoring NaNs) of the sample.
+    step = max(1, int(np.ceil(np.sqrt(data.size / COLOR_MAPPING_SAMPLE_SIZE))))
+    sample = data[::step, ::step]
+    with warnings.catch_warnings():
+        # All-NaN data results in NaNs (and a warning), which are handled below.
+        warnings.simplefilter("ignore", RuntimeWarning)
+        minimum = float(np.nanmin(sample))
+        maximum = float(np.nanpercentile(sample, 99))
+    scale = 255 / (maximum - minimum) if maximum > minimum else 0
+    if not np.isfinite(minimum):
+        minimum = 0
+
+    # Scale a few rows at a time into a small buffer, rather than making
+    # temporary arrays the size of the data. fmax maps NaNs to 0.
+    indices = np.empty(data.shape, np.uint8)
+    rows = max(1, COLOR_MAPPING_CHUNK_SIZE // max(1, data.shape[1]))
+    buffer = np.empty((rows, data.shape[1]), np.float32)
+    for i in range(0, data.shape[0], rows):
+        chunk = buffer[: min(rows, data.shape[0] - i)]
+        np.subtract(data[i : i + rows], minimum, out=chunk)
+        np.multiply(chunk, scale, out=chunk)
+        np.fmax(chunk, 0, out=chunk)
+        np.minimum(chunk, 255, out=chunk)
+        np.copyto(indices[i : i + rows], chunk, casting="unsafe")
+
+    return indices
@@ -3,11 +3,23 @@ from typing import Callable, cast, Tuple
 import numpy as np
 from pewlib import Laser
 from PySide6 import QtCore, QtGui, QtWidgets
-import scipy as sp
 
+from datamerger import config
 from datamerger.io.sized_data import SizedData
+from datamerger.lru_cache import LRUCache
+from datamerger.merge import ELEMENT_SIZES, Alignment, manipulate_data
+from datamerger.registration import Registration, register
+from datamerger.util import show_critical_message_box
+from .color_mapping import map_data_to_color_indices
+from .element_image_cache import ElementImageCache
+from .job_scheduler import Job, JobScheduler
+from .tiled_image_item import TiledImageItem
 from .turbo_color_table import turbo_color_table
 
+# The maximum width and height of the previews shown while other data is being
+# manipulated.
+PREVIEW_SIZE = 512
+
 
 class DataAlignmentView(QtWidgets.QWidget):
     def __init__(
@@ -18,13 +30,31 @@ class DataAlignmentView(QtWidgets.QWidget):
         super().__init__(parent)
 
         self.__element: str | None = None
+        self.__element_images: ElementImageCache | None = None
         self.__element_size: float = 1
         self.__element_sizes: list[float] = []
+
+        # Runs DataManipulator and AutoAligner. Only the latest job's result is
+        # used, e.g. results for data that has since been cleared are ignored.
+        self.__job_scheduler = JobScheduler()
+
         self.__laser: Laser | None = None
-        self.__laser_pixmap_item: QtWidgets.QGraphicsPixmapItem | None = None
+        self.__laser_image_item: TiledImageItem | None = None
+
+        # Images (colour table indices) of the manipulated other data, keyed by
+        # the identity of the other data, the element size, the rotation, and
+        # the pixel width of the elemental data. It only contains images for
+        # __manipulated_image_cache_source, which is kept separately from
+        # __other_data so the cache survives clear_data (e.g. when leaving and
+        # returning to a page).
+        self.__manipulated_image_cache: LRUCache[
+            tuple[int, float, int, float], np.ndarray
+        ] = LRUCache(config.MANIPULATED_IMAGE_CACHE_SIZE, lambda image: image.nbytes)
+        self.__manipulated_image_cache_source: SizedData | None = None
+
         self.__other_data: SizedData | None = None
-        self.__other_data_manipulated: np.ndarray | None = None
-        self.__other_data_pixmap_item: QtWidgets.QGraphicsPixmapItem | None = None
+        self.__other_data_image_item: TiledImageItem | None = None
+        self.__other_data_preview: np.ndarray | None = None
         self.__on_aligned_data_changed = on_aligned_data_changed
         self.__rotation: int = 0
 
@@ -43,11 +73,21 @@ class DataAlignmentView(QtWidgets.QWidget):
         self.__rotate_button.setAutoDefault(False)
         self.__rotate_button.setEnabled(False)
 
+        self.__auto_align_button = QtWidgets.QPushButton("Auto align", self)
+        self.__auto_align_button.clicked.connect(self.__on_auto_align_clicked)
+        self.__auto_align_button.setAutoDefault(False)
+        self.__auto_align_button.setEnabled(False)
+        self.__auto_align_button.setToolTip(
+            "Find the element size, rotation, and position that best align the data"
+            " with the selected element"
+        )
+
         # Lay out toolbar items horizontally.
         toolbar_layout = QtWidgets.QHBoxLayout()
         toolbar_layout.addWidget(self.__element_combo_box)
         toolbar_layout.addWidget(self.__element_size_combo_box)
         toolbar_layout.addWidget(self.__rotate_button)
+        toolbar_layout.addWidget(self.__auto_align_button)
         toolbar_layout.addStretch()
 
         self.__graphics_view = GraphicsView(self)
@@ -60,65 +100,74 @@ class DataAlignmentView(QtWidgets.QWidget):
         self.setLayout(layout)
 
     @property
-    def aligned_data(self) -> np.ndarray | None:
-        if (
-            self.__laser is None
-            or self.__other_data_manipulated is None
-            or self.__other_data_pixmap_item is None
-        ):
+    def alignment(self) -> Alignment | None:
+        """How the other data is currently aligned, or None if there's no
+        data."""
+        if self.__laser is None or self.__other_data_image_item is None:
             return None
 
-        # Select the portion of data that overlaps the elemental data.
-        height, width = self.__laser.data.shape
-        x, y = cast(
-            Tuple[int, int], self.__other_data_pixmap_item.pos().toPoint().toTuple()
+        position = cast(
+            Tuple[float, float], self.__other_data_image_item.pos().toTuple()
         )
-        overlap = self.__other_data_manipulated[
-            max(0, -y) : max(0, height - y), max(0, -x) : max(0, width - x)
-        ]
-
-        # Determine the dtype. This assumes all elements use the same dtype.
-        dtype = self.__laser.get(self.__laser.elements[0]).dtype
+        return Alignment(self.__element_size, position, self.__rotation)
 
-        # Create an array that has the same dimensions as the elemental data and
-        # insert the overlapping portion at the position it's shown in the UI.
-        aligned_data = np.zeros(self.__laser.data.shape, dtype)
-        aligned_data[
-            max(0, y) : max(0, y) + overlap.shape[0],
-            max(0, x) : max(0, x) + overlap.shape[1],
-        ] = overlap
-
-        return aligned_data
+    @property
+    def is_aligned(self) -> bool:
+        """Whether the other data is shown, so `alignment` isn't None."""
+        return self.__laser is not None and self.__other_data_image_item is not None
 
     def clear_data(self) -> None:
-        if self.__laser_pixmap_item:
-            self.__scene.removeItem(self.__laser_pixmap_item)
+        self.__job_scheduler.cancel()
+
+        if self.__laser_image_item:
+            self.__scene.removeItem(self.__laser_image_item)
 
         self.__element = None
+        self.__element_images = None
         self.__laser = None
-        self.__laser_pixmap_item = None
+        self.__laser_image_item = None
 
-        if self.__other_data_pixmap_item:
-            self.__scene.removeItem(self.__other_data_pixmap_item)
+        if self.__other_data_image_item:
+            self.__scene.removeItem(self.__other_data_image_item)
 
         self.__other_data = None
-        self.__other_data_manipulated = None
-        self.__other_data_pixmap_item = None
+        self.__other_data_image_item = None
+        self.__other_data_preview = None
         self.__rotation = 0
 
-    def set_data(self, laser: Laser, other_data: SizedData) -> None:
+    def set_data(
+        self,
+        laser: Laser,
+        other_data: SizedData,
+        element_images: ElementImageCache,
+    ) -> None:
+        """Shows data to be aligned.
+
+        :param laser: The elemental data, which is shown in a fixed position.
+        :param other_data: The data to align with the elemental data.
+        :param element_images: The cache of images of the elements of `laser`.
+        """
+        # Cached images are only useful for the same other data, so free the
+        # memory otherwise.
+        if other_data is not self.__manipulated_image_cache_source:
+            self.__manipulated_image_cache.clear()
+            self.__manipulated_image_cache_source = other_data
+
         self.clear_data()
 
-        # Render the elemental data in a fixed position.
+        # Render the elemental data in a fixed position. Images of the other
+        # elements are made in the background.
+        element_images.set_laser(laser)
         self.__element = laser.elements[0]
+        self.__element_images = element_images
         self.__element_combo_box.clear()
         self.__element_combo_box.addItems(laser.elements)
         self.__laser = laser
-        self.__recreate_laser_pixmap_item()
+        self.__recreate_laser_image_item()
 
         # Update the element size controls.
         self.__element_size = other_data.element_size
-        self.__element_sizes = sorted(set([5, 10, 20, 50, other_data.element_size]))
+        self.__element_sizes = sorted(set([*ELEMENT_SIZES, other_data.element_size]))
         self.__element_size_combo_box.clear()
         self.__element_size_combo_box.addItems(
             [f"{size} µm" for size in self.__element_sizes]
@@ -127,9 +176,15 @@ class DataAlignmentView(QtWidgets.QWidget):
             self.__element_sizes.index(other_data.element_size)
         )
 
-        # Prepare the other data in a background thread.
+        # Take every nth element of the other data, such that previews can be
+        # made quickly regardless of the size of the data. They're copied so
+        # making a preview doesn't read from memory-mapped data.
         self.__other_data = other_data
-        self.__recreate_other_data_pixmap_item(QtCore.QPoint(0, 0))
+        step = -(-max(other_data.data.shape) // PREVIEW_SIZE)
+        self.__other_data_preview = other_data.data[::step, ::step].astype(
+            config.COMPUTE_DTYPE
+        )
+        self.__recreate_other_data_image_item(QtCore.QPointF(0, 0))
 
         # Center on the elemental data and reset the zoom.
         self.__graphics_view.setSceneRect(
@@ -138,31 +193,70 @@ class DataAlignmentView(QtWidgets.QWidget):
         self.__graphics_view.resetTransform()
 
     def __disable_controls(self) -> None:
+        self.__auto_align_button.setEnabled(False)
         self.__element_size_combo_box.setEnabled(False)
         self.__rotate_button.setEnabled(False)
 
     def __enable_controls(self) -> None:
+        self.__auto_align_button.setEnabled(True)
         self.__element_size_combo_box.setEnabled(True)
         self.__rotate_button.setEnabled(True)
 
-    def __on_data_manipulator_success(
-        self, other_data_manipulated: np.ndarray, position: QtCore.QPoint
-    ) -> None:
-        if self.__other_data_pixmap_item is not None:
-            self.__scene.removeItem(self.__other_data_pixmap_item)
+    def __get_other_data_size(self) -> tuple[float, float]:
+        """Returns the width and height of the rotated and resampled other data
+        in elemental data pixels."""
+        assert self.__laser is not None and self.__other_data is not None
+        rows, columns = np.rot90(self.__other_data.data, k=self.__rotation).shape
+        zoom = (
+            self.__element_size
+            * self.__other_data.reduction
+            / self.__laser.config.get_pixel_width()
+        )
+        return columns * zoom, rows * zoom
+
+    def __on_auto_aligner_error(self) -> None:
+        # Starting AutoAligner may have superseded a DataManipulator, so start
+        # another.
+        assert self.__other_data_image_item is not None
+        self.__recreate_other_data_image_item(self.__other_data_image_item.pos())
+
+        show_critical_message_box(
+            self, "Failed to align the data automatically. See logs for more details."
+        )
+
+    def __on_auto_aligner_success(self, registration: Registration) -> None:
+        # Select the element size without triggering recalculation.
+        self.__element_size = registration.element_size
+        with QtCore.QSignalBlocker(self.__element_size_combo_box):
+            self.__element_size_combo_box.setCurrentIndex(
+                self.__element_sizes.index(registration.element_size)
+            )
+
+        self.__rotation = registration.rotation
+        self.__recreate_other_data_image_item(QtCore.QPointF(*registration.position))
+
+    @QtCore.Slot()
+    def __on_auto_align_clicked(self) -> None:
+        if self.__other_data_image_item is None:
+            return
+
+        assert self.__laser is not None and self.__other_data is not None
+        self.__disable_controls()
 
-        self.__other_data_manipulated = other_data_manipulated
-        self.__other_data_pixmap_item = self.__scene.addPixmap(
-            make_pixmap_from_data(other_data_manipulated)
+        auto_aligner = AutoAligner(
+            self.__element_sizes,
+            self.__laser.get(self.__element),
+            self.__laser.config.get_pixel_width(),
+            self.__other_data,
         )
-        self.__other_data_pixmap_item.setFlags(
-            QtWidgets.QGraphicsItem.GraphicsItemFlag.ItemIsMovable
+        self.__job_scheduler.start(
+            auto_aligner, self.__on_auto_aligner_success, self.__on_auto_aligner_error
+        )
+
+    def __on_data_manipulator_error(self) -> None:
+        show_critical_message_box(
+            self, "Failed to rotate or resize the data. See logs for more details."
         )
-        self.__other_data_pixmap_item.setOpacity(0.5)
-        self.__other_data_pixmap_item.setPos(position.toPointF())
-        self.__other_data_pixmap_item.setZValue(1)
-        self.__enable_controls()
-        self.__on_aligned_data_changed()
 
     @QtCore.Slot()
     def __on_element_combo_box_current_index_changed(self, index: int) -> None:
@@ -170,76 +264,114 @@ class DataAlignmentView(QtWidgets.QWidget):
             return
 
         self.__element = self.__laser.elements[index]
-        self.__recreate_laser_pixmap_item()
+        self.__recreate_laser_image_item()
 
     @QtCore.Slot()
     def __on_element_size_combo_box_current_index_changed(self, index: int) -> None:
-        if len(self.__element_sizes) == 0 or self.__other_data_pixmap_item is None:
+        if len(self.__element_sizes) == 0 or self.__other_data_image_item is None:
             return
 
         self.__element_size = self.__element_sizes[index]
-
-        # We want to disable controls that can cause recalculation of the other
-        # data, and the wizard's next button until recalculation is complete. To
-        # disable the next button we clear __other_data_manipulated which causes
-        # aligned_data to return None, which in turn disables the next button.
-        self.__disable_controls()
-        self.__other_data_manipulated = None
-        self.__on_aligned_data_changed()
-
-        self.__recreate_other_data_pixmap_item(
-            self.__other_data_pixmap_item.pos().toPoint()
-        )
+        self.__recreate_other_data_image_item(self.__other_data_image_item.pos())
 
     @QtCore.Slot()
     def __on_rotate_clicked(self) -> None:
-        # If a pixmap item doesn't already exist DataManipulator is probably
-        # running and we should wait until that's finished before rotating.
-        if self.__other_data_pixmap_item is None:
+        if self.__other_data_image_item is None:
             return
 
-        self.__rotation = (self.__rotation + 1) % 4
+        # Calculate the new position such that the data rotates around its
+        # centre (as opposed to keeping the top-left corner fixed).
+        width, height = self.__get_other_data_size()
+        position = self.__other_data_image_item.pos()
+        new_position = position + QtCore.QPointF(width - height, height - width) * 0.5
 
-        # See the comment in __on_element_size_combo_box_current_index_changed.
-        self.__disable_controls()
-        self.__other_data_manipulated = None
-        self.__on_aligned_data_changed()
-
-        # Calculate the position of the new pixmap item such that it rotates
-        # around its centre (as opposed to keeping the top-left corner fixed).
-        position = self.__other_data_pixmap_item.pos().toPoint()
-        width, height = cast(
-            Tuple[int, int], self.__other_data_pixmap_item.pixmap().size().toTuple()
+        self.__rotation = (self.__rotation + 1) % 4
+        self.__recreate_other_data_image_item(new_position)
+
+    def __recreate_laser_image_item(self) -> None:
+        assert self.__element is not None and self.__element_images is not None
+        elemental_image = self.__element_images.get(self.__element)
+        if self.__laser_image_item is None:
+            self.__laser_image_item = TiledImageItem(elemental_image, turbo_color_table)
+            self.__scene.addItem(self.__laser_image_item)
+        else:
+            self.__laser_image_item.set_indices(elemental_image)
+
+    def __recreate_other_data_image_item(self, position: QtCore.QPointF) -> None:
+        """Shows the other data in the graphics view with the current element
+        size and rotation.
+
+        The data is shown immediately, so the user can continue aligning it.
+        Unless the other data has previously been manipulated with the same
+        element size and rotation, what's shown is a low resolution preview
+        that's replaced once the manipulated data has been calculated in a
+        background thread.
+
+        :param position: Where to place the data.
+        """
+        assert self.__laser is not None and self.__other_data is not None
+        key = (
+            id(self.__other_data),
+            self.__element_size,
+            self.__rotation,
+            self.__laser.config.get_pixel_width(),
         )
-        new_position = position + QtCore.QPoint(width - height, height - width) * 0.5
-        self.__recreate_other_data_pixmap_item(new_position)
 
-    def __recreate_laser_pixmap_item(self) -> None:
-        assert self.__laser is not None
-        elemental_data = self.__laser.get(self.__element)
-        elemental_pixmap = make_pixmap_from_data(elemental_data)
-        if self.__laser_pixmap_item is not None:
-            self.__scene.removeItem(self.__laser_pixmap_item)
-        self.__laser_pixmap_item = self.__scene.addPixmap(elemental_pixmap)
+        # If the data has been manipulated this way before, reuse the result.
+        # Otherwise, stretch the preview to the size of the manipulated data.
+        width, height = self.__get_other_data_size()
+        cached_image = self.__manipulated_image_cache.get(key)
+        if cached_image is None:
+            assert self.__other_data_preview is not None
+            image = map_data_to_color_indices(
+                np.rot90(self.__other_data_preview, k=self.__rotation)
+            )
+            transform = QtGui.QTransform.fromScale(
+                width / image.shape[1], height / image.shape[0]
+            )
+        else:
+            image = cached_image
+            transform = QtGui.QTransform()
+
+        if self.__other_data_image_item is None:
+            self.__other_data_image_item = TiledImageItem(image, turbo_color_table)
+            self.__other_data_image_item.setFlag(
+                QtWidgets.QGraphicsItem.GraphicsItemFlag.ItemIsMovable
+            )
+            self.__other_data_image_item.setOpacity(0.5)
+            self.__other_data_image_item.setZValue(1)
+            self.__scene.addItem(self.__other_data_image_item)
+        else:
+            self.__other_data_image_item.set_indices(image)
+
+        self.__other_data_image_item.setTransform(transform)
+        self.__other_data_image_item.setPos(position)
+        self.__enable_controls()
+        self.__on_aligned_data_changed()
 
-    def __recreate_other_data_pixmap_item(self, position: QtCore.QPoint) -> None:
-        """(Re)calculates the manipulated other data, creates an associated
-            pixmap item, and shows it in the graphics view.
+        if cached_image is not None:
+            self.__job_scheduler.cancel()
+            return
 
-        If a pixmap item already exists it is removed.
+        def on_data_manipulator_success(image: np.ndarray) -> None:
+            # Cached images are shared, so prevent them from being modified.
+            image.setflags(write=False)
+            self.__manipulated_image_cache.put(key, image)
 
-        :param position: Where to place the resulting pixmap item.
-        """
+            # Replace the preview, leaving the position alone as the user may
+            # have moved the data since.
+            assert self.__other_data_image_item is not None
+            self.__other_data_image_item.set_indices(image)
+            self.__other_data_image_item.setTransform(QtGui.QTransform())
 
-        def on_data_manipulator_success(other_data_manipulated: np.ndarray):
-            self.__on_data_manipulator_success(other_data_manipulated, position)
-
-        assert self.__laser is not None and self.__other_data is not None
         data_manipulator = DataManipulator(
             self.__element_size, self.__laser, self.__rotation, self.__other_data
         )
-        data_manipulator.signals.success.connect(on_data_manipulator_success)
-        QtCore.QThreadPool.globalInstance().start(data_manipulator)
+        self.__job_scheduler.start(
+            data_manipulator,
+            on_data_manipulator_success,
+            self.__on_data_manipulator_error,
+        )
 
     @property
     def __scene(self) -> QtWidgets.QGraphicsScene:
@@ -264,46 +396,52 @@ class GraphicsView(QtWidgets.QGraphicsView):
         self.scale(scale, scale)
 
 
-def make_pixmap_from_data(data: np.ndarray) -> QtGui.QPixmap:
-    """Makes a pixmap from a two-dimensional array of data.
+class AutoAligner(Job):
+    """Finds the element size, rotation, and position that best align other
+    data with an element of the elemental data.
 
-    Uses the turbo colour table to colour the data.
+    This can be quite computationally intensive, so we do it in another thread.
+    Its result is a `Registration`.
     """
-    assert data.ndim == 2, "Can't make an image from an array that isn't 2D"
 
-    # Determine the minimum and maximum values (ignoring NaNs).
-    minimum = np.nanmin(data)
-    maximum = np.nanpercentile(data, 99)
+    def __init__(
+        self,
+        element_sizes: list[float],
+        elemental_data: np.ndarray,
+        pixel_width: float,
+        sized_data: SizedData,
+    ) -> None:
+        """Initialise the instance.
 
-    # Convert values to uint8s to be used as indices into the lookup table.
-    # If there are any NaNs NumPy will warn that they're invalid and convert
-    # them to 0s. The context manager suppresses those warnings.
-    with np.errstate(invalid="ignore"):
-        data = (255 * (data - minimum) / (maximum - minimum)).astype(np.uint8)
+        :param element_sizes: The candidate element sizes of sized_data.
+        :param elemental_data: The element of the elemental data to align with.
+        :param pixel_width: The width of each pixel of the elemental data in µm.
+        :param sized_data: The data to align with the elemental data.
+        """
+        super().__init__()
 
-    # Create an image from the data.
-    image = QtGui.QImage(
-        data.data,
-        data.shape[1],
-        data.shape[0],
-        data.strides[0],
-        QtGui.QImage.Format.Format_Indexed8,
-    )
-    image.setColorTable(turbo_color_table)
-    image.setColorCount(len(turbo_color_table))
+        self.__element_sizes = element_sizes
+        self.__elemental_data = elemental_data
+        self.__pixel_width = pixel_width
+        self.__sized_data = sized_data
 
-    return QtGui.QPixmap.fromImage(image)
+    def compute(self) -> Registration:
+        return register(
+            self.__elemental_data,
+            self.__pixel_width,
+            self.__sized_data,
+            self.__element_sizes,
+        )
 
 
-class DataManipulator(QtCore.QRunnable):
+class DataManipulator(Job):
     """Manipulates data (rotates, zooms, etc.).
 
     This can be quite computationally intensive, so we do it in another thread.
+    Its result is an image of the manipulated data, made by
+    `map_data_to_color_indices`.
     """
 
-    class Signals(QtCore.QObject):
-        success = QtCore.Signal(np.ndarray)
-
     def __init__(
         self, element_size: float, laser: Laser, rotation: int, sized_data: SizedData
     ) -> None:
@@ -322,20 +460,14 @@ class DataManipulator(QtCore.QRunnable):
         self.__element_size = element_size
         self.__laser = laser
         self.__rotation = rotation
-        self.signals = self.Signals()
         self.__sized_data = sized_data
 
-    def run(self) -> None:
-        # First, remove NaNs otherwise they spread everywhere when we zoom.
-        data = np.nan_to_num(self.__sized_data.data, nan=20)
-
-        # Rotate in increments of 90 degrees.
-        data = np.rot90(data, k=self.__rotation)
-
-        # Resample the image so it has the same resolution as the laser data.
-        data = sp.ndimage.zoom(
-            data,
-            self.__element_size / self.__laser.config.get_pixel_width(),
+    def compute(self) -> np.ndarray:
+        data = manipulate_data(
+            self.__sized_data,
+            self.__element_size,
+            self.__rotation,
+            self.__laser.config.get_pixel_width(),
+            config.COMPUTE_DTYPE,
         )
-
-        self.signals.success.emit(data)
+        return map_data_to_color_indices(data)
@@ -0,0 +1,99 @@
+import numpy as np
+from pewlib import Laser
+
+from datamerger import config
+from datamerger.lru_cache import LRUCache
+from .color_mapping import map_data_to_color_indices
+from .job_scheduler import Job, JobScheduler
+
+
+class ElementImageCache:
+    """Images (colour table indices) of each element of elemental data.
+
+    When elemental data is set, images of its elements are made in a background
+    thread so switching between elements is instant. The cache is shared by the
+    alignment views, so the images are only made once.
+    """
+
+    def __init__(self, capacity: int = config.ELEMENT_IMAGE_CACHE_SIZE) -> None:
+        """Initialise the instance.
+
+        :param capacity: The maximum total size of the images in bytes.
+        """
+        self.__capacity = capacity
+        self.__images = self.__make_images_cache()
+        self.__job_scheduler = JobScheduler()
+        self.__laser: Laser | None = None
+
+    def get(self, element: str) -> np.ndarray:
+        """Returns the image of an element, making it if necessary.
+
+        The image mustn't be modified.
+        """
+        assert self.__laser is not None
+        image = self.__images.get(element)
+        if image is None:
+            image = map_data_to_color_indices(self.__laser.get(element))
+            image.setflags(write=False)
+            self.__images.put(element, image)
+
+        return image
+
+    def set_laser(self, laser: Laser) -> None:
+        """Sets the elemental data and starts making images of its elements.
+
+        Images of any previous elemental data are discarded. Setting the same
+        elemental data again has no effect.
+        """
+        if laser is self.__laser:
+            return
+
+        # The previous job may still be adding images to the previous cache, so
+        # replace it rather than clearing it.
+        self.__images = self.__make_images_cache()
+        self.__laser = laser
+        self.__job_scheduler.start(
+            MakeElementImages(self.__capacity, self.__images, laser),
+            lambda _: None,
+            lambda: None,
+        )
+
+    def __make_images_cache(self) -> LRUCache[str, np.ndarray]:
+        return LRUCache(self.__capacity, lambda image: image.nbytes)
+
+
+class MakeElementImages(Job):
+    """Makes images of the elements of elemental data, in order, until they'd
+    exceed the capacity of the cache.
+
+    The images are added to the cache as they're made, so the job has no
+    result.
+    """
+
+    def __init__(
+        self, capacity: int, images: LRUCache[str, np.ndarray], laser: Laser
+    ) -> None:
+        """Initialise the instance.
+
+        :param capacity: The capacity of `images` in bytes.
+        :param images: The cache to add the images to, keyed by element.
+        :param laser: The elemental data.
+        """
+        super().__init__()
+
+        self.__capacity = capacity
+        self.__images = images
+        self.__laser = laser
+
+    def compute(self) -> None:
+        size = 0
+        for element in self.__laser.elements:
+            size += self.__laser.shape[0] * self.__laser.shape[1]
+            if self.cancelled or size > self.__capacity:
+                return
+
+            # The image may have been requested before the job reached it.
+            if self.__images.get(element) is None:
+                image = map_data_to_color_indices(self.__laser.get(element))
+                image.setflags(write=False)
+                self.__images.put(element, image)
@@ -0,0 +1,139 @@
+import abc
+import logging
+from typing import Any, Callable
+
+from PySide6 import QtCore
+
+from datamerger import instrumentation
+
+
+class Job(QtCore.QRunnable):
+    """The base class for jobs that run in the global thread pool, e.g. those run
+    by a `JobScheduler`.
+
+    Subclasses implement `compute`. If the job is cancelled before or while it's
+    computing its result it emits neither the error nor the success signal.
+    """
+
+    # Whether `compute` emits progress signals as it computes its result.
+    reports_progress = False
+
+    class Signals(QtCore.QObject):
+        error = QtCore.Signal()
+        # The fraction of the result that has been computed, from 0 to 1.
+        progress = QtCore.Signal(float)
+        success = QtCore.Signal(object)
+
+    def __init__(self, **details: object) -> None:
+        """Initialise the instance.
+
+        :param details: Details of the job to record when it's measured and to
+            log if it fails, e.g. the path of a file.
+        """
+        super().__init__()
+
+        self.signals = self.Signals()
+        self.__cancelled = False
+        self.__details = details
+
+    def cancel(self) -> None:
+        self.__cancelled = True
+
+    @property
+    def cancelled(self) -> bool:
+        """Whether the job has been cancelled. Long-running implementations of
+        `compute` can check this and return early."""
+        return self.__cancelled
+
+    @abc.abstractmethod
+    def compute(self) -> object:
+        """Computes the job's result. This is called in a background thread."""
+
+    def run(self) -> None:
+        if self.__cancelled:
+            return
+
+        try:
+            with instrumentation.measure(type(self).__name__, **self.__details):
+                result = self.compute()
+        except:
+            if not self.__cancelled:
+                logging.exception(
+                    ", ".join(
+                        [
+                            f"{type(self).__name__} failed",
+                            *[
+                                f"{key}={value}"
+                                for key, value in self.__details.items()
+                            ],
+                        ]
+                    )
+                )
+                self.signals.error.emit()
+            return
+
+        if not self.__cancelled:
+            self.signals.success.emit(result)
+
+
+class JobScheduler:
+    """Runs jobs in the global thread pool such that each job supersedes the
+    previous one.
+
+    Starting a job cancels the previous job. If the previous job hasn't started
+    yet it's removed from the thread pool, so a burst of jobs only computes the
+    latest one. If it's already running it can't be interrupted (unless it
+    checks `Job.cancelled`), but its result is ignored, so results can't arrive
+    out of order.
+    """
+
+    def __init__(self) -> None:
+        # Incremented whenever a job is cancelled so signals from old jobs can
+        # be ignored.
+        self.__generation = 0
+        self.__job: Job | None = None
+
+    def cancel(self) -> None:
+        """Cancels the current job and ignores any signals it subsequently
+        emits."""
+        self.__generation += 1
+
+        if self.__job is not None:
+            self.__job.cancel()
+            QtCore.QThreadPool.globalInstance().tryTake(self.__job)
+            self.__job = None
+
+    def start(
+        self,
+        job: Job,
+        on_success: Callable[[Any], None],
+        on_error: Callable[[], None],
+    ) -> None:
+        """Cancels the current job and starts another.
+
+        :param job: The job to start.
+        :param on_success: Called with the job's result if it succeeds and
+            hasn't been superseded.
+        :param on_error: Called if the job fails and hasn't been superseded.
+        """
+        self.cancel()
+        generation = self.__generation
+
+        def on_job_error() -> None:
+            if generation == self.__generation:
+                self.__job = None
+                on_error()
+
+        def on_job_success(result: Any) -> None:
+            if generation == self.__generation:
+                self.__job = None
+                on_success(result)
+
+        job.signals.error.connect(on_job_error)
+        job.signals.success.connect(on_job_success)
+
+        # The scheduler keeps ownership of the job so it can be cancelled later.
+        job.setAutoDelete(False)
+        self.__job = job
+
+        QtCore.QThreadPool.globalInstance().start(job)
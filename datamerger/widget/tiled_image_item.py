@@ -0,0 +1,137 @@
+import math
+
+import numpy as np
+from PySide6 import QtCore, QtGui, QtWidgets
+
+from datamerger import config, instrumentation
+from datamerger.lru_cache import LRUCache
+
+# The width and height of each tile in pixels.
+TILE_SIZE = 256
+
+
+class TiledImageItem(QtWidgets.QGraphicsItem):
+    """Shows an indexed image, which may be too large for a single pixmap.
+
+    Only the tiles that are visible are drawn. When the view is zoomed out, the
+    tiles are made from every 2nd, 4th, etc. pixel of the image (levels 1, 2,
+    etc.) so the number of pixels drawn is proportional to the size of the
+    viewport rather than the image. Tiles are cached as pixmaps until the cache
+    exceeds `config.TILE_CACHE_SIZE`.
+
+    Each pixel of the image occupies one unit of the item's coordinate system.
+    """
+
+    def __init__(
+        self,
+        indices: np.ndarray,
+        color_table: list[int],
+        parent: QtWidgets.QGraphicsItem | None = None,
+    ) -> None:
+        """Initialise the instance.
+
+        :param indices: A two-dimensional array of indices into `color_table`.
+        :param color_table: The colours of the image as ARGB values, e.g.
+            `turbo_color_table`.
+        :param parent: The parent of this item.
+        """
+        super().__init__(parent)
+
+        self.__color_table = color_table
+        self.__indices = indices
+
+        # Pixmaps of tiles, keyed by level, row, and column.
+        self.__tile_cache: LRUCache[tuple[int, int, int], QtGui.QPixmap] = LRUCache(
+            config.TILE_CACHE_SIZE,
+            lambda pixmap: pixmap.width() * pixmap.height() * pixmap.depth() // 8,
+        )
+
+        # Only draw the exposed part of the item (see paint).
+        self.setFlag(
+            QtWidgets.QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption
+        )
+
+    def boundingRect(self) -> QtCore.QRectF:
+        return QtCore.QRectF(0, 0, self.__indices.shape[1], self.__indices.shape[0])
+
+    def paint(
+        self,
+        painter: QtGui.QPainter,
+        option: QtWidgets.QStyleOptionGraphicsItem,
+        widget: QtWidgets.QWidget | None = None,
+    ) -> None:
+        # Choose the level with roughly one pixel per pixel of the viewport.
+        level_of_detail = option.levelOfDetailFromTransform(painter.worldTransform())
+        level = 0
+        if level_of_detail < 1:
+            max_level = math.ceil(math.log2(max(self.__indices.shape)))
+            level = min(max_level, math.floor(math.log2(1 / level_of_detail)))
+
+        # Draw the tiles that intersect the exposed rectangle.
+        # The stubs are missing exposedRect.
+        exposed_rect = option.exposedRect.intersected(  # type: ignore[attr-defined]
+            self.boundingRect()
+        )
+        tile_extent = TILE_SIZE << level
+        first_row = int(exposed_rect.top()) // tile_extent
+        last_row = math.ceil(exposed_rect.bottom()) // tile_extent
+        first_column = int(exposed_rect.left()) // tile_extent
+        last_column = math.ceil(exposed_rect.right()) // tile_extent
+        for row in range(first_row, last_row + 1):
+            for column in range(first_column, last_column + 1):
+                self.__draw_tile(painter, level, row, column)
+
+    def set_indices(self, indices: np.ndarray) -> None:
+        """Replaces the image.
+
+        :param indices: A two-dimensional array of indices into the colour
+            table.
+        """
+        self.prepareGeometryChange()
+        self.__indices = indices
+        self.__tile_cache.clear()
+        self.update()
+
+    def __draw_tile(
+        self, painter: QtGui.QPainter, level: int, row: int, column: int
+    ) -> None:
+        tile_extent = TILE_SIZE << level
+        top = row * tile_extent
+        left = column * tile_extent
+        bottom = min(top + tile_extent, self.__indices.shape[0])
+        right = min(left + tile_extent, self.__indices.shape[1])
+        if top >= bottom or left >= right:
+            return
+
+        key = (level, row, column)
+        pixmap = self.__tile_cache.get(key)
+        if pixmap is None:
+            step = 1 << level
+            with instrumentation.measure(
+                "TiledImageItem tile", level=level, row=row, column=column
+            ):
+                pixmap = self.__make_pixmap(
+                    self.__indices[top:bottom:step, left:right:step]
+                )
+            self.__tile_cache.put(key, pixmap)
+
+        painter.drawPixmap(
+            QtCore.QRectF(left, top, right - left, bottom - top),
+            pixmap,
+            QtCore.QRectF(pixmap.rect()),
+        )
+
+    def __make_pixmap(self, indices: np.ndarray) -> QtGui.QPixmap:
+        # QImage requires rows to be contiguous.
+        indices = np.ascontiguousarray(indices, np.uint8)
+        image = QtGui.QImage(
+            indices.data,
+            indices.shape[1],
+            indices.shape[0],
+            indices.strides[0],
+            QtGui.QImage.Format.Format_Indexed8,
+        )
+        image.setColorTable(self.__color_table)
+        image.setColorCount(len(self.__color_table))
+
+        return QtGui.QPixmap.fromImage(image)
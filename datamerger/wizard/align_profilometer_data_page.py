@@ -1,7 +1,7 @@
-import numpy as np
 from PySide6 import QtWidgets
 
 from datamerger.widget import DataAlignmentView
+from datamerger.merge import Alignment
 from . import wizard_page as wp
 
 
@@ -30,14 +30,16 @@ class AlignProfilometerDataPage(wp.WizardPage):
         elemental_data = self.get_wizard().elemental_data
         profilometer_data = self.get_wizard().profilometer_data
         assert elemental_data is not None and profilometer_data is not None
-        self.__data_alignment_view.set_data(elemental_data, profilometer_data)
+        self.__data_alignment_view.set_data(
+            elemental_data, profilometer_data, self.get_wizard().element_image_cache
+        )
 
     def cleanupPage(self) -> None:
         self.__data_alignment_view.clear_data()
 
     def isComplete(self) -> bool:
-        return self.__data_alignment_view.aligned_data is not None
+        return self.__data_alignment_view.is_aligned
 
     @property
-    def aligned_data(self) -> np.ndarray | None:
-        return self.__data_alignment_view.aligned_data
+    def alignment(self) -> Alignment | None:
+        return self.__data_alignment_view.alignment
@@ -1,41 +1,153 @@
-from pewlib.io.npz import save
-from PySide6 import QtWidgets
+from pewlib import Laser
+from PySide6 import QtCore, QtWidgets
 
+from datamerger import instrumentation
+from datamerger.io.npz import save
+from datamerger.io.sized_data import SizedData
+from datamerger.merge import Alignment, add_aligned_data, align_data
 from datamerger.util import show_critical_message_box
+from datamerger.widget.job_scheduler import Job
 from . import wizard_page as wp
 
 
 class DonePage(wp.WizardPage):
-    """The final page of the wizard that confirms the file has been output."""
+    """The final page of the wizard that saves the merged data and confirms the
+    file has been saved.
+
+    The data is aligned and saved in a background thread so the UI stays
+    responsive.
+    """
 
     def __init__(self, parent: QtWidgets.QWidget | None = None) -> None:
         super().__init__(parent)
 
-        self.setLayout(QtWidgets.QVBoxLayout())
+        # Whether saving has finished, successfully or not.
+        self.__finished = False
+
+        self.__progress_bar = QtWidgets.QProgressBar()
+        self.__progress_bar.setMaximum(100)
+
+        # The job that's saving the data. The page keeps a reference to it so
+        # it isn't deleted while it's running.
+        self.__save_data: SaveData | None = None
+
+        layout = QtWidgets.QVBoxLayout()
+        layout.addStretch()
+        layout.addWidget(self.__progress_bar)
+        layout.addStretch()
+
+        self.setLayout(layout)
+
+    def initializePage(self) -> None:
+        laser = self.get_wizard().elemental_data
+        assert laser is not None, "Elemental data is missing"
+
+        path = self.get_wizard().output_path
+        assert path != "", "Output path is missing"
+
+        self.__finished = False
+        self.__progress_bar.setValue(0)
+        self.__progress_bar.show()
+        self.setSubTitle("Saving your file. This might take a few seconds.")
+        self.setTitle("Saving")
+
+        # Aligning the data resamples it, which can take a while, so it's done
+        # by the job rather than here.
+        other_data: list[tuple[str, SizedData, Alignment]] = []
+        for element, sized_data, alignment in [
+            (
+                "Brillouin",
+                self.get_wizard().brillouin_data,
+                self.get_wizard().brillouin_alignment,
+            ),
+            (
+                "Profilometer",
+                self.get_wizard().profilometer_data,
+                self.get_wizard().profilometer_alignment,
+            ),
+        ]:
+            if sized_data is not None and alignment is not None:
+                other_data.append((element, sized_data, alignment))
+
+        self.__save_data = SaveData(
+            laser, other_data, path, self.get_wizard().compress_output
+        )
+        self.__save_data.signals.error.connect(self.__on_save_data_error)
+        self.__save_data.signals.progress.connect(self.__on_save_data_progress)
+        self.__save_data.signals.success.connect(self.__on_save_data_success)
+        QtCore.QThreadPool.globalInstance().start(self.__save_data)
+
+    def isComplete(self) -> bool:
+        # Disable the finish button until saving has finished.
+        return self.__finished
+
+    def __on_save_data_error(self) -> None:
+        self.__finished = True
+        self.__progress_bar.hide()
+        self.setSubTitle("An error occurred and your file wasn't saved.")
+        self.setTitle("Error")
+        self.completeChanged.emit()
+        show_critical_message_box(
+            self, "Failed to save the file. See logs for more details."
+        )
+
+    def __on_save_data_progress(self, fraction: float) -> None:
+        self.__progress_bar.setValue(round(fraction * self.__progress_bar.maximum()))
+
+    def __on_save_data_success(self) -> None:
+        self.__finished = True
+        self.__progress_bar.hide()
         self.setSubTitle("Your file has been saved.")
         self.setTitle("Done")
+        self.completeChanged.emit()
 
-    def initializePage(self) -> None:
-        try:
-            laser = self.get_wizard().elemental_data
-            assert laser is not None, "Elemental data is missing"
-
-            brillouin_data = self.get_wizard().aligned_brillouin_data
-            if brillouin_data is not None:
-                if "Brillouin" in laser.elements:
-                    laser.remove("Brillouin")
-                laser.add("Brillouin", brillouin_data)
-
-            profilometer_data = self.get_wizard().aligned_profilometer_data
-            if profilometer_data is not None:
-                if "Profilometer" in laser.elements:
-                    laser.remove("Profilometer")
-                laser.add("Profilometer", profilometer_data)
-
-            path = self.get_wizard().output_path
-            assert path != "", "Output path is missing"
-            save(path, laser)
-        except BaseException as e:
-            self.setTitle("Error")
-            self.setSubTitle("An error occurred and your file wasn't saved.")
-            raise e
+
+class SaveData(Job):
+    """Aligns other data with elemental data, adds it, and saves the result.
+
+    The elemental data isn't modified; the aligned data is added to a copy.
+    Progress is the fraction of the file that has been written.
+    """
+
+    reports_progress = True
+
+    def __init__(
+        self,
+        laser: Laser,
+        other_data: list[tuple[str, SizedData, Alignment]],
+        path: str,
+        compressed: bool,
+    ) -> None:
+        """Initialise the instance.
+
+        :param laser: The elemental data.
+        :param other_data: The name of the element to add each other data as
+            (e.g. "Brillouin"), the data, and how to align it.
+        :param path: The path to save the merged data to.
+        :param compressed: Whether to compress the file.
+        """
+        super().__init__(compressed=compressed, path=path)
+
+        self.__compressed = compressed
+        self.__laser = laser
+        self.__other_data = other_data
+        self.__path = path
+
+    def compute(self) -> None:
+        laser = Laser(
+            self.__laser.data,
+            calibration=dict(self.__laser.calibration),
+            config=self.__laser.config,
+            info=dict(self.__laser.info),
+        )
+        for element, sized_data, alignment in self.__other_data:
+            with instrumentation.measure(f"Align {element} data"):
+                aligned_data = align_data(self.__laser, sized_data, alignment)
+            add_aligned_data(laser, element, aligned_data)
+
+        save(
+            self.__path,
+            laser,
+            self.__compressed,
+            lambda fraction: self.signals.progress.emit(fraction),
+        )
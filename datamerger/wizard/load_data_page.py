@@ -1,15 +1,20 @@
+import abc
+import functools
 import logging
-from typing import Callable
+from typing import Any, Callable
 
-import numpy as np
 from pewlib import Laser
 from pewlib.io.npz import load as load_npz
 from PySide6 import QtCore, QtWidgets
 
+from datamerger.io import cache
 from datamerger.io.brillouin import load as load_brillouin
+from datamerger.io.npz import load_pixel_width
 from datamerger.io.profilometer import load as load_profilometer
 from datamerger.io.sized_data import SizedData
+from datamerger.merge import ELEMENT_SIZES, get_maximum_element_size
 from datamerger.util import show_critical_message_box
+from datamerger.widget.job_scheduler import Job
 from . import wizard_page as wp
 
 logger = logging.getLogger(__name__)
@@ -18,8 +23,14 @@ logger = logging.getLogger(__name__)
 class LoadDataPage(wp.WizardPage):
     """The page of the wizard that loads selected data into memory.
 
-    If the data loads successfully the wizard moves to the next page. If it
-    fails to load the wizard shows an error and moves to the previous page.
+    All of the selected data is loaded in parallel. If it all loads successfully
+    the wizard moves to the next page. If any of it fails to load the remaining
+    jobs are cancelled and the wizard shows an error and moves to the previous
+    page. The user can also cancel loading and move to the previous page.
+
+    The Brillouin and profilometer data's progress bars show the fraction of
+    their files that has been read. The elemental data's progress bar is
+    intentionally a busy indicator, as pewlib loads it in a single step.
     """
 
     def __init__(self, parent: QtWidgets.QWidget | None = None) -> None:
@@ -29,15 +40,37 @@ class LoadDataPage(wp.WizardPage):
         self.__laser: Laser | None = None
         self.__profilometer_data: SizedData | None = None
 
-        # Show an indeterminate progress bar to indicate that something is happening.
-        progress_bar = QtWidgets.QProgressBar()
-        progress_bar.setMaximum(0)
-        progress_bar.setMinimum(0)
+        # The jobs that are loading data. Incremented whenever jobs are
+        # cancelled so signals from old jobs can be ignored.
+        self.__generation = 0
+        self.__jobs: list[LoadData] = []
+
+        # Show a progress bar for each type of data.
+        self.__brillouin_progress_bar = QtWidgets.QProgressBar()
+        self.__elemental_progress_bar = QtWidgets.QProgressBar()
+        self.__profilometer_progress_bar = QtWidgets.QProgressBar()
+
+        self.__progress_layout = QtWidgets.QFormLayout()
+        self.__progress_layout.addRow("Elemental data:", self.__elemental_progress_bar)
+        self.__progress_layout.addRow("Brillouin data:", self.__brillouin_progress_bar)
+        self.__progress_layout.addRow(
+            "Profilometer data:", self.__profilometer_progress_bar
+        )
+        self.__progress_layout.setFieldGrowthPolicy(
+            QtWidgets.QFormLayout.FieldGrowthPolicy.ExpandingFieldsGrow
+        )
+
+        # The back button is hidden because the previous page is a commit page,
+        # so provide another way to return to it.
+        cancel_button = QtWidgets.QPushButton("Cancel")
+        cancel_button.clicked.connect(lambda: self.wizard().back())
+        cancel_button.setAutoDefault(False)
 
-        # Vertically centre the progress bar.
+        # Vertically centre the progress bars.
         layout = QtWidgets.QVBoxLayout()
         layout.addStretch()
-        layout.addWidget(progress_bar)
+        layout.addLayout(self.__progress_layout)
+        layout.addWidget(cancel_button, 0, QtCore.Qt.AlignmentFlag.AlignRight)
         layout.addStretch()
 
         self.setLayout(layout)
@@ -45,15 +78,67 @@ class LoadDataPage(wp.WizardPage):
         self.setTitle("Load data")
 
     def initializePage(self) -> None:
-        # Load all the data in serial to make it easier to handle the case where
-        # loading one fails. Otherwise we need to cancel parallel jobs, etc.
-        self.__load_brillouin_data()
+        def set_brillouin_data(brillouin_data: SizedData) -> None:
+            self.__brillouin_data = brillouin_data
+
+        def set_laser(laser: Laser) -> None:
+            self.__laser = laser
+
+        def set_profilometer_data(profilometer_data: SizedData) -> None:
+            self.__profilometer_data = profilometer_data
+
+        brillouin_data_path = self.get_wizard().brillouin_data_path
+        elemental_data_path = self.get_wizard().elemental_data_path
+        profilometer_data_path = self.get_wizard().profilometer_data_path
+        assert elemental_data_path != ""
+
+        # Create all the jobs before starting any so a fast job can't finish
+        # before the others are created and move to the next page early.
+        self.__add_job(
+            LoadElementalData(elemental_data_path),
+            "elemental",
+            self.__elemental_progress_bar,
+            set_laser,
+        )
+        if brillouin_data_path != "":
+            self.__add_job(
+                LoadBrillouinData(brillouin_data_path),
+                "Brillouin",
+                self.__brillouin_progress_bar,
+                set_brillouin_data,
+            )
+        if profilometer_data_path != "":
+            self.__add_job(
+                LoadProfilometerData(profilometer_data_path, elemental_data_path),
+                "profilometer",
+                self.__profilometer_progress_bar,
+                set_profilometer_data,
+            )
+
+        self.__progress_layout.setRowVisible(
+            self.__brillouin_progress_bar, brillouin_data_path != ""
+        )
+        self.__progress_layout.setRowVisible(
+            self.__profilometer_progress_bar, profilometer_data_path != ""
+        )
+
+        for job in self.__jobs:
+            QtCore.QThreadPool.globalInstance().start(job)
 
     def cleanupPage(self) -> None:
+        self.__cancel_jobs()
+
         self.__brillouin_data = None
         self.__laser = None
         self.__profilometer_data = None
 
+        for progress_bar in [
+            self.__brillouin_progress_bar,
+            self.__elemental_progress_bar,
+            self.__profilometer_progress_bar,
+        ]:
+            progress_bar.reset()
+
     def isComplete(self) -> bool:
         # Disable the next button so the user can't move to the next page.
         return False
@@ -70,116 +155,141 @@ class LoadDataPage(wp.WizardPage):
     def profilometer_data(self) -> SizedData | None:
         return self.__profilometer_data
 
-    def __load_brillouin_data(self) -> None:
-        def on_success(brillouin_data: SizedData | None):
-            self.__brillouin_data = brillouin_data
-            self.__load_elemental_data()
+    def __add_job(
+        self,
+        job: "LoadData",
+        data_type: str,
+        progress_bar: QtWidgets.QProgressBar,
+        on_success: Callable[[Any], None],
+    ) -> None:
+        """Prepares a job to be started and connects its signals.
+
+        :param job: The job.
+        :param data_type: The type of data the job loads, used in messages.
+        :param progress_bar: The progress bar that shows the job's progress.
+        :param on_success: Called with the loaded data if the job succeeds.
+        """
+        generation = self.__generation
+
+        def on_job_error() -> None:
+            if generation != self.__generation:
+                return
 
-        path = self.get_wizard().brillouin_data_path
-        if path == "":
-            on_success(None)
-            return
+            self.wizard().back()
+            show_critical_message_box(
+                self, f"Failed to load {data_type} data. See logs for more details."
+            )
 
-        load_brillouin_data = LoadBrillouinData(path)
-        load_brillouin_data.signals.error.connect(
-            self.__make_error_handler("Brillouin")
-        )
-        load_brillouin_data.signals.success.connect(on_success)
-        QtCore.QThreadPool.globalInstance().start(load_brillouin_data)
+        def on_job_progress(fraction: float) -> None:
+            if generation == self.__generation:
+                progress_bar.setValue(round(fraction * progress_bar.maximum()))
 
-    def __load_elemental_data(self) -> None:
-        def on_success(laser: Laser):
-            self.__laser = laser
-            self.__load_profilometer_data()
+        def on_job_success(data: Any) -> None:
+            if generation != self.__generation:
+                return
 
-        path = self.get_wizard().elemental_data_path
-        assert path != ""
-        load_elemental_data = LoadElementalData(path)
-        load_elemental_data.signals.error.connect(
-            self.__make_error_handler("elemental")
-        )
-        load_elemental_data.signals.success.connect(on_success)
-        QtCore.QThreadPool.globalInstance().start(load_elemental_data)
+            on_success(data)
+            progress_bar.setMaximum(100)
+            progress_bar.setValue(100)
 
-    def __load_profilometer_data(self) -> None:
-        def on_success(profilometer_data: SizedData | None):
-            self.__profilometer_data = profilometer_data
-            self.wizard().next()
+            # Move to the next page once all the data has loaded.
+            self.__jobs.remove(job)
+            if len(self.__jobs) == 0:
+                self.wizard().next()
 
-        path = self.get_wizard().profilometer_data_path
-        if path == "":
-            on_success(None)
-            return
+        job.signals.error.connect(on_job_error)
+        job.signals.progress.connect(on_job_progress)
+        job.signals.success.connect(on_job_success)
 
-        load_profilometer_data = LoadProfilometerData(path)
-        load_profilometer_data.signals.error.connect(
-            self.__make_error_handler("profilometer")
-        )
-        load_profilometer_data.signals.success.connect(on_success)
-        QtCore.QThreadPool.globalInstance().start(load_profilometer_data)
+        # The page keeps ownership of the job so it can be cancelled later.
+        job.setAutoDelete(False)
+        self.__jobs.append(job)
 
-    def __make_error_handler(self, data_type: str) -> Callable[[], None]:
-        def on_error():
-            self.wizard().back()
-            show_critical_message_box(
-                self, f"Failed to load {data_type} data. See logs for more details."
-            )
+        # Jobs that don't report their progress show a busy indicator instead.
+        progress_bar.setMaximum(100 if job.reports_progress else 0)
+        progress_bar.setValue(0)
 
-        return on_error
+    def __cancel_jobs(self) -> None:
+        """Cancels all jobs and ignores any signals they subsequently emit."""
+        self.__generation += 1
 
+        for job in self.__jobs:
+            job.cancel()
+            QtCore.QThreadPool.globalInstance().tryTake(job)
 
-class LoadBrillouinData(QtCore.QRunnable):
-    class Signals(QtCore.QObject):
-        error = QtCore.Signal()
-        success = QtCore.Signal(np.ndarray)
+        self.__jobs = []
+
+
+class LoadData(Job):
+    """The base class for jobs that load data from a file.
+
+    Subclasses implement `load`. Long-running implementations can check
+    `cancelled` and stop early by raising an exception.
+    """
 
     def __init__(self, path: str) -> None:
-        super().__init__()
+        super().__init__(path=path)
 
-        self.signals = self.Signals()
         self.__path = path
 
-    def run(self) -> None:
-        try:
-            self.signals.success.emit(load_brillouin(self.__path))
-        except:
-            logging.exception(f"Failed to load Brillouin data at {self.__path}")
-            self.signals.error.emit()
+    def compute(self) -> object:
+        return self.load(self.__path)
 
+    @abc.abstractmethod
+    def load(self, path: str) -> object:
+        """Loads the data at `path`."""
 
-class LoadElementalData(QtCore.QRunnable):
-    class Signals(QtCore.QObject):
-        error = QtCore.Signal()
-        success = QtCore.Signal(Laser)
 
-    def __init__(self, path: str) -> None:
-        super().__init__()
+class LoadBrillouinData(LoadData):
+    reports_progress = True
 
-        self.signals = self.Signals()
-        self.__path = path
+    def load(self, path: str) -> SizedData:
+        return cache.load(
+            path,
+            functools.partial(
+                load_brillouin,
+                on_progress=self.signals.progress.emit,
+                is_cancelled=lambda: self.cancelled,
+            ),
+        )
 
-    def run(self) -> None:
-        try:
-            self.signals.success.emit(load_npz(self.__path))
-        except:
-            logging.exception(f"Failed to load elemental data at {self.__path}")
-            self.signals.error.emit()
 
+class LoadElementalData(LoadData):
+    def load(self, path: str) -> Laser:
+        return load_npz(path)
 
-class LoadProfilometerData(QtCore.QRunnable):
-    class Signals(QtCore.QObject):
-        error = QtCore.Signal()
-        success = QtCore.Signal(np.ndarray)
 
-    def __init__(self, path: str) -> None:
-        super().__init__()
+class LoadProfilometerData(LoadData):
+    reports_progress = True
 
-        self.signals = self.Signals()
-        self.__path = path
+    def __init__(self, path: str, elemental_data_path: str) -> None:
+        """Initialise the instance.
 
-    def run(self) -> None:
-        try:
-            self.signals.success.emit(load_profilometer(self.__path))
-        except:
-            logging.exception(f"Failed to load profilometer data at {self.__path}")
-            self.signals.error.emit()
+        :param path: The path to the profilometer data.
+        :param elemental_data_path: The path to the elemental data, whose pixel
+            width the data's resolution is reduced to suit.
+        """
+        super().__init__(path)
+
+        self.__elemental_data_path = elemental_data_path
+
+    def load(self, path: str) -> SizedData:
+        # Only the elemental data's config is read, so this doesn't wait for
+        # the elemental data to load.
+        maximum_element_size = get_maximum_element_size(
+            load_pixel_width(self.__elemental_data_path)
+        )
+
+        # Reading a large file takes a while, so report progress and stop as
+        # soon as the job is cancelled.
+        return cache.load(
+            path,
+            functools.partial(
+                load_profilometer,
+                on_progress=self.signals.progress.emit,
+                is_cancelled=lambda: self.cancelled,
+                maximum_element_size=maximum_element_size,
+                # The user can choose any of these element sizes.
+                largest_element_size=max(ELEMENT_SIZES),
+            ),
+        )
@@ -17,8 +17,17 @@ class OutputPage(QtWidgets.QWizardPage):
             file_mode=QtWidgets.QFileDialog.FileMode.AnyFile,
         )
 
+        # Compression makes the file much smaller, but saving large files takes
+        # much longer.
+        self.__compress_check_box = QtWidgets.QCheckBox("Compress the file")
+        self.__compress_check_box.setChecked(True)
+        self.__compress_check_box.setToolTip(
+            "Compressed files are smaller but take longer to save"
+        )
+
         layout = QtWidgets.QVBoxLayout()
         layout.addWidget(self.__path_select_widget)
+        layout.addWidget(self.__compress_check_box)
 
         self.setLayout(layout)
         self.setSubTitle(
@@ -30,6 +39,10 @@ class OutputPage(QtWidgets.QWizardPage):
     def isComplete(self) -> bool:
         return self.__path_select_widget.path != ""
 
+    @property
+    def compressed(self) -> bool:
+        return self.__compress_check_box.isChecked()
+
     @property
     def path(self) -> str:
         return self.__path_select_widget.path
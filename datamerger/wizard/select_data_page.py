@@ -19,7 +19,7 @@ class SelectDataPage(wp.WizardPage):
         super().__init__(parent)
 
         self.__brillouin_path_select_widget = PathSelectWidget(
-            "Brillouin files (*.xlsx)",
+            "Brillouin files (*.xlsx *.csv *.tsv)",
             lambda: self.completeChanged.emit(),
         )
         self.__elemental_path_select_widget = PathSelectWidget(
@@ -2,13 +2,14 @@ import logging
 from typing import Type
 from types import TracebackType
 
-import numpy as np
 from pewlib import Laser
 from PySide6 import QtCore, QtWidgets
 
-from datamerger import config
+from datamerger import config, instrumentation
 from datamerger.io.sized_data import SizedData
+from datamerger.merge import Alignment
 from datamerger.util import show_critical_message_box
+from datamerger.widget import ElementImageCache
 from . import (
     align_brillouin_data_page as abdp,
     align_profilometer_data_page as apdp,
@@ -33,6 +34,9 @@ class Wizard(QtWidgets.QWizard):
     def __init__(self, parent: QtWidgets.QWidget | None = None) -> None:
         super().__init__(parent)
 
+        # Shared by the align data pages.
+        self.__element_image_cache = ElementImageCache()
+
         # See __on_current_id_changed for more information.
         self.__previous_page_id = self.__select_data_page_id
         self.currentIdChanged.connect(self.__on_current_id_changed)
@@ -58,6 +62,10 @@ class Wizard(QtWidgets.QWizard):
         self.setWindowTitle(config.PROGRAM_NAME)
         self.setWizardStyle(QtWidgets.QWizard.WizardStyle.ClassicStyle)
 
+    @property
+    def element_image_cache(self) -> ElementImageCache:
+        return self.__element_image_cache
+
     def nextId(self) -> int:
         page_ids = [
             i
@@ -105,6 +113,7 @@ class Wizard(QtWidgets.QWizard):
         # becomes invalid and the user is stuck on the select data page.
         previous_page_id = self.__previous_page_id
         self.__previous_page_id = new_id
+        instrumentation.mark("Page changed", page=type(self.currentPage()).__name__)
 
         if (
             new_id == self.__load_data_page_id
@@ -155,8 +164,8 @@ class Wizard(QtWidgets.QWizard):
         return page
 
     @property
-    def aligned_profilometer_data(self) -> np.ndarray | None:
-        return self.__get_align_profilometer_data_page().aligned_data
+    def profilometer_alignment(self) -> Alignment | None:
+        return self.__get_align_profilometer_data_page().alignment
 
     # AlignBrillouinDataPage properties
     def __get_align_brillouin_data_page(self) -> abdp.AlignBrillouinDataPage:
@@ -165,8 +174,8 @@ class Wizard(QtWidgets.QWizard):
         return page
 
     @property
-    def aligned_brillouin_data(self) -> np.ndarray | None:
-        return self.__get_align_brillouin_data_page().aligned_data
+    def brillouin_alignment(self) -> Alignment | None:
+        return self.__get_align_brillouin_data_page().alignment
 
     # OutputPage properties
     def __get_output_page(self) -> op.OutputPage:
@@ -174,6 +183,10 @@ class Wizard(QtWidgets.QWizard):
         assert isinstance(page, op.OutputPage)
         return page
 
+    @property
+    def compress_output(self) -> bool:
+        return self.__get_output_page().compressed
+
     @property
     def output_path(self) -> str:
         return self.__get_output_page().path
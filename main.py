@@ -1,11 +1,19 @@
+import argparse
+import logging
 import sys
 
 from PySide6 import QtWidgets
 
+from datamerger import config, instrumentation
 from datamerger.wizard import Wizard
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=config.PROGRAM_NAME)
+    instrumentation.add_arguments(parser)
+    if instrumentation.enable_from_arguments(parser.parse_args()):
+        logging.basicConfig(level=logging.INFO)
+
     app = QtWidgets.QApplication()
     wizard = Wizard()
     sys.excepthook = wizard.excepthook
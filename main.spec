@@ -12,11 +12,12 @@ a = Analysis(
     runtime_hooks=[],
 )
 pyz = PYZ(a.pure)
+# The binaries and data are collected into a directory alongside the executable
+# (rather than being embedded in it) so they needn't be extracted to a temporary
+# directory every time the application starts, which takes several seconds.
 exe = EXE(
     pyz,
     a.scripts,
-    a.binaries,
-    a.datas,
     [],
     argv_emulation=False,
     bootloader_ignore_signals=False,
@@ -25,15 +26,23 @@ exe = EXE(
     debug=False,
     disable_windowed_traceback=False,
     entitlements_file=None,
+    exclude_binaries=True,
     name="main",
-    runtime_tmpdir=None,
     strip=False,
     target_arch=None,
+    upx=True,
+)
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.datas,
+    name="main",
+    strip=False,
     upx_exclude=[],
     upx=True,
 )
 app = BUNDLE(
-    exe,
+    coll,
     bundle_identifier=None,
     icon=None,
     name="main.app",